@@ -9,7 +9,7 @@ import os
 
 from odfdo import Document, Table, Row
 
-from utils import keys_to_int
+from utils import keys_to_int, load_data
 from resources.enums import Characters, Symbol, FatalStrikeType, SearchPointType
 
 
@@ -63,8 +63,8 @@ class InputTemplate:
             assert os.path.isfile(artes_ids_file), f'{artes_ids_file} does not exist'
             assert os.path.isfile(artes_data_file), f'{artes_data_file} does not exist'
 
-            self.artes_ids = json.load(open(artes_ids_file), object_hook=keys_to_int)
-            artes_data = json.load(open(artes_data_file))['artes']
+            self.artes_ids = load_data(artes_ids_file, keys_to_int)
+            artes_data = load_data(artes_data_file)['artes']
 
             artes_data_table = {}
             artes_by_char = {}
@@ -88,12 +88,12 @@ class InputTemplate:
             assert os.path.isfile(skills_data_file), f'{skills_data_file} does not exist'
             assert os.path.isfile(skills_char_data_file), f'{skills_char_data_file} does not exist'
 
-            self.skill_ids = json.load(open(skills_ids_file), object_hook=keys_to_int)
+            self.skill_ids = load_data(skills_ids_file, keys_to_int)
 
             self.skills_data_table = {int(skill['id']) : skill
-                                      for skill in json.load(open(skills_data_file))['skills']}
+                                      for skill in load_data(skills_data_file)['skills']}
 
-            self.skills_by_char = json.load(open(skills_char_data_file), object_hook=keys_to_int)
+            self.skills_by_char = load_data(skills_char_data_file, keys_to_int)
 
         item_dependents: set[str] = set(targets).intersection({'items', 'shops', 'chests', 'search'})
         search_only: bool = len(item_dependents) == 1 and 'search' in item_dependents
@@ -104,8 +104,8 @@ class InputTemplate:
             assert os.path.isfile(items_ids_file), f"File {items_file} does not exist."
             assert os.path.isfile(items_file), f"File {items_file} does not exist."
 
-            self.item_ids = json.load(open(items_ids_file), object_hook=keys_to_int)
-            self.items_list = json.load(open(items_file))['items']
+            self.item_ids = load_data(items_ids_file, keys_to_int)
+            self.items_list = load_data(items_file)['items']
 
             self.item_by_category = {}
             self.common_items = []
@@ -185,35 +185,35 @@ class InputTemplate:
         artes_data: str = os.path.join(wd, "data", "templates", "artes_api.json")
         assert os.path.isfile(artes_data)
 
-        return json.load(open(artes_data))
+        return load_data(artes_data)
 
     @staticmethod
     def generate_skills_input() -> dict:
         skills_data: str = os.path.join(wd, "data", "templates", "skills_api.json")
         assert os.path.isfile(skills_data)
 
-        return json.load(open(skills_data))
+        return load_data(skills_data)
 
     @staticmethod
     def generate_items_input() -> dict:
         items_data: str = os.path.join(wd, "data", "templates", "items_api.json")
         assert os.path.isfile(items_data)
 
-        return json.load(open(items_data))
+        return load_data(items_data)
 
     @staticmethod
     def generate_shop_items_input() -> dict:
         shop_items_data: str = os.path.join(wd, "data", "templates", "shop_items_api.json")
         assert os.path.isfile(shop_items_data)
 
-        return json.load(open(shop_items_data), object_hook=keys_to_int)
+        return load_data(shop_items_data, keys_to_int)
 
     @staticmethod
     def generate_chests_input() -> dict:
         chests_data: str = os.path.join(wd, "data", "chests.json")
         assert os.path.isfile(chests_data)
 
-        return json.load(open(chests_data))
+        return load_data(chests_data)
 
     def generate_artes_report(self, patched_artes: dict) -> Table:
         report_list: list = []
@@ -412,7 +412,7 @@ class InputTemplate:
         name_file: str = os.path.join(wd, "data", "named_npc_maps.json")
         assert os.path.isfile(name_file), f"'{name_file}' not found"
 
-        id_to_name: dict[str, str] = json.load(open(name_file))
+        id_to_name: dict[str, str] = load_data(name_file)
 
         report_list = []
         for area, chests in sorted(patched_items.items()):
@@ -437,7 +437,7 @@ class InputTemplate:
         search_point_file: str = os.path.join(wd, "data", "named_search_points.json")
         assert os.path.isfile(search_point_file), f"'{search_point_file}' not found"
 
-        search_point_names: list[str] = json.load(open(search_point_file))['FIELD']
+        search_point_names: list[str] = load_data(search_point_file)['FIELD']
 
         report_list: list = []
         last_cont_idx: int = 0
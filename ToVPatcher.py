@@ -1,3 +1,4 @@
+import hashlib
 import shutil
 
 import utils
@@ -6,33 +7,72 @@ import json
 import sys
 import os
 
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait
+from multiprocessing import freeze_support
 
-from packer import VesperiaPacker
+from packer import (VesperiaPacker, build_format_version, checksums, dependency_native, dependency_partial_scenario,
+                    tov_btl, tov_item, tov_npc, tov_scenario)
 from patcher import VesperiaPatcher
+from runner import ToolError, tools
+from package import is_package
 
 class VesperiaPatcherApp:
     packer: VesperiaPacker
     patcher: VesperiaPatcher
 
     patch_data: dict
+    identifier: str
     targets: list = []
 
     clean: bool = False
+    package: bool = False
     threads: int
 
     def __init__(self, patch_data: str, max_threads: int = 4, apply_immediately: bool = False,
-                 clean_build: bool = False):
+                 clean_build: bool = False, fast_compression: bool = False, recheck: bool = False,
+                 package_output: bool = False):
         self.patch_data = json.load(open(patch_data), object_hook=utils.keys_to_int)
-        identifier = f"{self.patch_data['player']}-{self.patch_data['created']}"
+        self.identifier = self.build_identity(patch_data, fast_compression,
+                                              VesperiaPacker.config_setting(dependency_native, True),
+                                              package_output,
+                                              VesperiaPacker.config_setting(dependency_partial_scenario, False))
 
-        self.packer = VesperiaPacker(identifier, apply_immediately)
+        self.packer = VesperiaPacker(self.identifier, apply_immediately, fast_compression, recheck)
 
-        self.patcher = VesperiaPatcher(identifier)
+        self.patcher = VesperiaPatcher(self.identifier, checksums[os.path.basename(tov_btl)])
 
         self.threads = max_threads
+        tools.max_concurrency = max_threads
 
         self.clean = clean_build
+        self.package = package_output
+
+    @staticmethod
+    def build_identity(patch_file: str, fast_compression: bool = False, native: bool = True,
+                       package_output: bool = False, partial_scenario: bool = False) -> str:
+        """
+        Identify a build by what it produces: the patch payload, the output format of the patcher, the tools and the
+        game files it is built from, and whether it is packaged. Names, dates and seeds do not change the patched files,
+        so they are left out.
+        """
+        with open(patch_file, "r") as file:
+            payload: dict = json.load(file)
+
+        for key in ("player", "created", "seed"):
+            payload.pop(key, None)
+
+        identity: dict = {
+            "payload": payload,
+            "format": build_format_version,
+            "fast_compression": fast_compression,
+            "native": native,
+            "partial_scenario": native and partial_scenario,
+            "package": package_output,
+            "checksums": checksums,
+        }
+        canonical: str = json.dumps(identity, sort_keys=True, separators=(",", ":"))
+
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
 
     def begin(self):
         start: float = time.time()
@@ -41,21 +81,37 @@ class VesperiaPatcherApp:
               f"\tPlayer: {self.patch_data['player']}\n"
               f"\tGeneration Date: {self.patch_data['created']}\n"
               f"\tSeed: {self.patch_data['seed']}\n"
+              f"\tBuild: {self.identifier}\n"
               f"\n\t[-/-] Threads: {self.threads}\n")
 
-        if 'artes' in self.patch_data or 'skills' in self.patch_data:
-            self.patch_btl()
+        self.verify_files()
 
-        if 'items' in self.patch_data:
-            self.patch_items()
+        # Share one HyoutaToolsCLI host for every command of this patch
+        self.packer.hyouta.start_worker()
+        try:
+            if 'artes' in self.patch_data or 'skills' in self.patch_data:
+                self.patch_btl()
 
-        if 'shops' in self.patch_data:
-            self.patch_scenario()
+            if 'items' in self.patch_data:
+                self.patch_items()
 
-        if 'chests' in self.patch_data or 'search' in self.patch_data:
-            self.patch_npc()
+            if 'shops' in self.patch_data:
+                self.patch_scenario()
+
+            if 'chests' in self.patch_data or 'search' in self.patch_data:
+                self.patch_npc()
+        finally:
+            self.packer.hyouta.stop_worker()
+            tools.close()
 
         self.packer.apply_patch()
+
+        output: str = self.packer.output_dir
+        if self.package:
+            output = self.packer.package_output()
+
+        self.packer.finish_output({key: self.patch_data.get(key) for key in ("player", "created", "seed")})
+
         end: float = time.time()
 
         if self.clean and os.path.isdir(self.packer.build_dir):
@@ -65,9 +121,67 @@ class VesperiaPatcherApp:
         if self.packer.apply_immediately:
             print("Automatically applied patch to the game directory.")
         else:
-            print(f"Patch Output: {self.packer.output_dir}")
+            print(f"Patch Output: {output}")
+
+    def required_files(self) -> list[str]:
+        files: list[str] = []
+        if 'artes' in self.patch_data or 'skills' in self.patch_data:
+            files.append(tov_btl)
+
+        if 'items' in self.patch_data:
+            files.append(tov_item)
+
+        if 'shops' in self.patch_data:
+            files.append(tov_scenario)
+
+        if 'chests' in self.patch_data or 'search' in self.patch_data:
+            files.append(tov_npc)
+
+        return [os.path.join(self.packer.vesperia_dir, file) for file in files]
+
+    def verify_files(self):
+        """
+        Verify every game file needed by the patch in parallel, and stop before anything is extracted if one fails.
+        Files are only backed up once all of them have been verified, so a failed check leaves the game untouched.
+        """
+        print("> Verifying Game Files...")
+
+        def _verify_job(original_path: str):
+            cached: bool = (self.packer.hash_cache.is_cached(self.packer.get_backup_path(original_path)) or
+                            self.packer.hash_cache.is_cached(original_path))
+
+            start: float = time.perf_counter()
+            path: str = self.packer.find_vesperia_file(original_path)
+            elapsed: float = time.perf_counter() - start
+
+            size: float = os.path.getsize(path) / 0x100000
+            if cached:
+                print(f"\t{os.path.basename(path)}: {size:.1f} MiB (cached)")
+            else:
+                print(f"\t{os.path.basename(path)}: {size:.1f} MiB in {elapsed:.2f}s "
+                      f"({size / max(elapsed, 1e-6):.1f} MiB/s)")
+
+        files: list[str] = self.required_files()
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            jobs: list = [executor.submit(_verify_job, file) for file in files]
+            wait(jobs)
+
+        for job in jobs: job.result()
+
+        # Every hash is cached by now, so this only moves the originals into the backup
+        for file in files:
+            self.packer.check_vesperia_file(file)
 
     def patch_btl(self):
+        # Artes and skills are fixed-size tables, so they can be patched directly inside BTL_PACK.DAT
+        if self.packer.native:
+            try:
+                self.patch_btl_in_place()
+                return
+            except ValueError as e:
+                print(f"> {e} Extracting BTL_PACK.DAT instead...")
+                self.patcher.members_in_place.clear()
+
         self.packer.unpack_btl()
 
         if 'artes' in self.patch_data:
@@ -84,6 +198,22 @@ class VesperiaPatcherApp:
 
         self.packer.pack_btl()
 
+    def patch_btl_in_place(self):
+        archive: str = self.packer.unpack_btl_in_place()
+
+        if 'artes' in self.patch_data:
+            self.patcher.members_in_place['artes'] = self.packer.locate_member(archive, ["0004", "ALL.0000"])
+        if 'skills' in self.patch_data:
+            self.patcher.members_in_place['skills'] = self.packer.locate_member(archive, ["0010", "ALL.0000"])
+
+        if 'artes' in self.patch_data:
+            print("> Patching Artes...")
+            self.patcher.patch_artes(self.patch_data['artes'])
+
+        if 'skills' in self.patch_data:
+            print("> Patching Skills...")
+            self.patcher.patch_skills(self.patch_data['skills'])
+
     def patch_items(self):
         print("> Patching Items...")
         self.packer.unpack_item()
@@ -91,7 +221,12 @@ class VesperiaPatcherApp:
         self.packer.copy_to_output('item')
 
     def patch_scenario(self):
-        self.packer.extract_scenario()
+        # Shops are all stored in the first member of the scenario container
+        members: list[str] = []
+        if 'shops' in self.patch_data:
+            members.append("0")
+
+        self.packer.extract_scenario(members=members)
 
         if 'shops' in self.patch_data:
             print("> Patching Shops...")
@@ -101,12 +236,20 @@ class VesperiaPatcherApp:
         self.packer.pack_scenario()
 
     def patch_npc(self):
-        self.packer.unpack_npc()
+        # Only the data files of the patched maps are needed in the build
+        maps: list[str] = list(self.patch_data.get('chests', {}).keys())
+        if 'search' in self.patch_data:
+            maps.append("FIELD")
+
+        self.packer.unpack_npc(maps)
 
         base_dir: str = os.path.join(self.packer.build_dir, "maps")
         if 'chests' in self.patch_data:
             print("> Patching Chests...")
 
+            # Each map is a chain of dependent steps that mix in-process work with external tools, so the chains run on
+            # threads. External tools still go through the shared runner, which bounds how many of them run at once,
+            # and the in-process steps spend their time in lzma and file I/O, which release the GIL.
             def _extract_job(room: str, chest_path: str, dec_path: str):
                 self.packer.extract_map(room)
                 self.packer.decompress_data(chest_path, dec_path)
@@ -116,24 +259,34 @@ class VesperiaPatcherApp:
                 self.packer.pack_map(room)
 
             with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                jobs: list = []
                 for area in self.patch_data['chests'].keys():
                     work_dir: str = os.path.join(base_dir, area)
                     chest: str = os.path.join(work_dir, area + ".tlzc.ext", "0004")
                     decomp_path: str = os.path.join(work_dir, "0004")
 
-                    executor.submit(_extract_job, area, chest, decomp_path)
+                    jobs.append(executor.submit(_extract_job, area, chest, decomp_path))
+
+                # Surface failures from the jobs instead of letting the executor swallow them
+                for job in jobs: job.result()
 
             with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                jobs: list = []
                 for area, chests in self.patch_data['chests'].items():
-                    executor.submit(self.patcher.patch_chests, area, chests)
+                    jobs.append(executor.submit(self.patcher.patch_chests, area, chests))
+
+                for job in jobs: job.result()
 
             with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                jobs: list = []
                 for area in self.patch_data['chests'].keys():
                     work_dir: str = os.path.join(base_dir, area)
                     dec_data: str = os.path.join(work_dir, "0004.tlzc")
                     chest_data: str = os.path.join(work_dir, area + ".tlzc.ext", "0004")
 
-                    executor.submit(_pack_job, area, chest_data, dec_data)
+                    jobs.append(executor.submit(_pack_job, area, chest_data, dec_data))
+
+                for job in jobs: job.result()
 
         if 'search' in self.patch_data:
             print("> Patching Search Points...")
@@ -153,10 +306,17 @@ class VesperiaPatcherApp:
         self.packer.copy_to_output('npc')
 
 if __name__ == '__main__':
+    # Required for worker processes in frozen builds
+    freeze_support()
+
     patch_file: str = ""
     threads: int = 4
     clean: bool = False
     apply: bool = False
+    fast: bool = False
+    package_output: bool = False
+    # Checked ahead of time, as management options are run as soon as they are parsed
+    recheck: bool = "--recheck" in sys.argv[1:]
 
     skip: bool = False
     for i, arg in enumerate(sys.argv[1:]):
@@ -171,10 +331,13 @@ if __name__ == '__main__':
                 "\n\n\tPatcher Options:"
                 "\n\t\t-t | --threads <amount>\t\tThe number of threads to use. Default: 4." 
                 "\n\t\t-c | --clean\t\t\tDelete the used builds subdirectory after patching."
+                "\n\t\t-f | --fast\t\t\tUse faster but weaker compression for repacked files. Meant for test builds."
+                "\n\t\t-p | --package\t\t\tPackage the patched files into a single uncompressed zip file."
+                "\n\t\t--recheck\t\t\tCheck all dependencies again, even if they were verified on a previous run."
                 "\n\t\t-a | --apply-immediately\tImmediately apply the patched files into the game directory, "
                 "and move the affected original files to a backup directory (<game_directory>/Data64/.backup)."
                 "\n\n\tManagement Options"
-                "\n\t\t-s | --set <output>\t\tApply the specified patch output."
+                "\n\t\t-s | --set <output>\t\tApply the specified patch output directory or package."
                 "\n\t\t-r | --restore-backup\t\tRestore Backups of the original unmodified files if present "
                 "and remove all instances of patched files in the game directory"
             )
@@ -187,20 +350,31 @@ if __name__ == '__main__':
             apply = True
         elif arg in ("-c", "--clean"):
             clean = True
+        elif arg in ("-f", "--fast"):
+            fast = True
+        elif arg in ("-p", "--package"):
+            package_output = True
+        elif arg == "--recheck":
+            continue
         elif arg in ("-s", "--set"):
             path: str = sys.argv[i + 2]
             check: str = os.path.join(path, "Data64")
-            if len(sys.argv) - 1 - i > 1 and os.path.isdir(path) and os.path.isdir(check):
-                packer = VesperiaPacker()
+            if len(sys.argv) - 1 - i > 1 and (os.path.isdir(check) or is_package(path)):
+                packer = VesperiaPacker(recheck=recheck)
                 packer.restore_backup(True)
-                packer.apply_patch(path)
+                try:
+                    packer.apply_patch(path)
+                except ValueError as e:
+                    print(f"<!> {e}")
+                    packer.recover_staging()
+                    sys.exit(1)
 
                 print(f"> Patch \"{path}\" has been applied to the game directory.")
             else:
-                print(f"> The patch output \"{path}\" either does not exist or is not a valid patch directory.")
+                print(f"> The patch output \"{path}\" either does not exist or is not a valid patch directory or package.")
             sys.exit(0)
         elif arg in ("-r", "--restore-backup"):
-            packer = VesperiaPacker()
+            packer = VesperiaPacker(recheck=recheck)
             packer.restore_backup()
             sys.exit(0)
         elif os.path.isfile(arg) and arg.endswith(".tovdepatch"):
@@ -212,5 +386,10 @@ if __name__ == '__main__':
         print("<!> No Valid Patch File was provided!")
         sys.exit(1)
 
-    app = VesperiaPatcherApp(patch_file, threads, apply, clean)
-    app.begin()
\ No newline at end of file
+    app = VesperiaPatcherApp(patch_file, threads, apply, clean, fast, recheck, package_output)
+    try:
+        app.begin()
+    except (ToolError, AssertionError, ValueError) as e:
+        print(f"<!> {e}")
+        print("> Aborting Patch...")
+        sys.exit(1)
\ No newline at end of file
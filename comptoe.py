@@ -0,0 +1,197 @@
+import utils
+
+# Compression Types
+comptoe_none: int = 0
+comptoe_lzss: int = 1
+comptoe_lzss_rle: int = 3
+
+comptoe_header_size: int = 9
+
+# LZSS Ring Buffer Parameters
+ring_size: int = 0x1000
+ring_start: int = 0xFEE
+match_min: int = 3
+match_max: int = 18
+
+rle_min: int = 4
+rle_short_max: int = 18
+rle_long_max: int = 0xFF + 19
+
+# Number of candidates checked per position when searching for matches
+chain_limit: int = 64
+
+
+def read_type(file: str) -> int:
+    """Get the compression type of a compressed file, or -1 if it does not exist or is not a compressed file."""
+    try:
+        with open(file, "rb") as f:
+            header: bytes = f.read(comptoe_header_size)
+    except OSError:
+        return -1
+
+    if len(header) < comptoe_header_size or header[0] not in (comptoe_none, comptoe_lzss, comptoe_lzss_rle):
+        return -1
+
+    return header[0]
+
+def decompress(data: bytes) -> bytes:
+    if len(data) < comptoe_header_size:
+        raise ValueError("Data is too short to be a compressed file.")
+
+    compression_type: int = data[0]
+    decompressed_size: int = int.from_bytes(data[5:9], "little")
+
+    if compression_type == comptoe_none:
+        return data[comptoe_header_size:comptoe_header_size + decompressed_size]
+    elif compression_type not in (comptoe_lzss, comptoe_lzss_rle):
+        raise ValueError(f"Unsupported compression type {compression_type}.")
+
+    output: bytearray = bytearray()
+    position: int = comptoe_header_size
+    flags: int = 0
+
+    try:
+        while len(output) < decompressed_size:
+            flags >>= 1
+            if not flags & 0x100:
+                flags = data[position] | 0xFF00
+                position += 1
+
+            if flags & 1:
+                output.append(data[position])
+                position += 1
+                continue
+
+            low: int = data[position]
+            high: int = data[position + 1]
+            position += 2
+
+            if compression_type == comptoe_lzss_rle and high & 0x0F == 0x0F:
+                if high >> 4:
+                    output += bytes([low]) * ((high >> 4) + 3)
+                else:
+                    output += bytes([data[position]]) * (low + 19)
+                    position += 1
+                continue
+
+            offset: int = low | ((high & 0xF0) << 4)
+            length: int = (high & 0x0F) + match_min
+
+            # Offsets point into the ring buffer, which starts zero-filled at 0xFEE
+            distance: int = ((len(output) + ring_start - offset) & (ring_size - 1)) or ring_size
+            source: int = len(output) - distance
+
+            if source < 0:
+                padding: int = min(-source, length)
+                output += bytes(padding)
+                source += padding
+                length -= padding
+
+            if distance >= length:
+                output += output[source:source + length]
+            else:
+                for i in range(length):
+                    output.append(output[source + i])
+    except IndexError:
+        raise ValueError("Compressed data ended unexpectedly.")
+
+    return bytes(output[:decompressed_size])
+
+def compress(data: bytes, compression_type: int = comptoe_lzss_rle) -> bytes:
+    if compression_type == comptoe_none:
+        body: bytes = bytes(data)
+    elif compression_type in (comptoe_lzss, comptoe_lzss_rle):
+        body: bytes = _compress_lzss(data, compression_type == comptoe_lzss_rle)
+    else:
+        raise ValueError(f"Unsupported compression type {compression_type}.")
+
+    return bytes([compression_type]) + len(body).to_bytes(4, "little") + len(data).to_bytes(4, "little") + body
+
+def _compress_lzss(data: bytes, rle: bool) -> bytes:
+    size: int = len(data)
+    # Type 3 reserves the 0xF length nibble for runs
+    max_length: int = match_max - 1 if rle else match_max
+    max_distance: int = ring_size - match_max
+
+    output: bytearray = bytearray()
+    flag_position: int = 0
+    flag_bit: int = 8
+    heads: dict[bytes, list[int]] = {}
+
+    position: int = 0
+    while position < size:
+        if flag_bit == 8:
+            flag_position = len(output)
+            output.append(0)
+            flag_bit = 0
+
+        run: int = 0
+        if rle:
+            limit: int = min(size, position + rle_long_max)
+            value: int = data[position]
+            run = 1
+            while position + run < limit and data[position + run] == value:
+                run += 1
+
+        best_length: int = 0
+        best_source: int = 0
+        if position + match_min <= size:
+            candidates: list[int] = heads.get(data[position:position + match_min], [])
+            limit: int = min(max_length, size - position)
+
+            for source in reversed(candidates[-chain_limit:]):
+                if position - source > max_distance: break
+
+                length: int = match_min
+                while length < limit and data[source + length] == data[position + length]:
+                    length += 1
+
+                if length > best_length:
+                    best_length = length
+                    best_source = source
+                    if length == limit: break
+
+        if rle and run >= rle_min and run > best_length:
+            if run <= rle_short_max:
+                output += bytes([data[position], ((run - 3) << 4) | 0x0F])
+            else:
+                output += bytes([run - 19, 0x0F, data[position]])
+            consumed: int = run
+        elif best_length >= match_min:
+            offset: int = (best_source + ring_start) & (ring_size - 1)
+            output += bytes([offset & 0xFF, ((offset >> 4) & 0xF0) | (best_length - match_min)])
+            consumed: int = best_length
+        else:
+            output[flag_position] |= 1 << flag_bit
+            output.append(data[position])
+            consumed: int = 1
+
+        flag_bit += 1
+
+        for i in range(position, min(position + consumed, size - match_min + 1)):
+            heads.setdefault(data[i:i + match_min], []).append(i)
+        position += consumed
+
+    return bytes(output)
+
+def decompress_file(file: str, out: str = ""):
+    with open(file, "rb") as f:
+        data: bytes = decompress(f.read())
+
+    _write(out if out else file, data)
+
+def compress_file(file: str, out: str = "", compression_type: int = -1):
+    """Compress a file. If not specified, the compression type of the file being replaced is kept."""
+    output: str = out if out else file
+    if compression_type < 0:
+        compression_type = read_type(output)
+        if compression_type < 0: compression_type = comptoe_lzss_rle
+
+    with open(file, "rb") as f:
+        data: bytes = compress(f.read(), compression_type)
+
+    _write(output, data)
+
+def _write(file: str, data: bytes):
+    with utils.write_atomic(file) as f:
+        f.write(data)
@@ -0,0 +1,354 @@
+import shutil
+import json
+import os
+
+import utils
+
+# FPS4 Content Bitmask Flags
+contains_start_pointers: int = 0x0001
+contains_sector_sizes: int = 0x0002
+contains_file_sizes: int = 0x0004
+contains_filenames: int = 0x0008
+contains_file_extensions: int = 0x0010
+contains_file_types: int = 0x0020
+contains_file_metadata: int = 0x0040
+contains_unknown1: int = 0x0080
+contains_unknown2: int = 0x0100
+
+fps4_magic: bytes = b"FPS4"
+fps4_header_size: int = 0x1C
+
+
+class FPS4Entry:
+    """Table of Contents Entry of an FPS4 Archive"""
+    def __init__(self, index: int, location: int = 0, sector_size: int = 0, file_size: int = 0,
+                 name: str = "", extension: str = "", file_type: str = "", metadata_location: int = 0,
+                 unknown: list[int] = None, metadata: str = ""):
+        self.index: int = index
+        self.location: int = location
+        self.sector_size: int = sector_size
+        self.file_size: int = file_size
+        self.name: str = name
+        self.extension: str = extension
+        self.file_type: str = file_type
+        self.metadata_location: int = metadata_location
+        self.unknown: list[int] = unknown if unknown is not None else []
+        self.metadata: str = metadata
+
+        self.path: str = ""
+
+    @property
+    def filename(self) -> str:
+        """Name of the member when extracted, following the naming used by ToVfps4e."""
+        if self.name:
+            return self.name + (f".{self.extension}" if self.extension else "")
+
+        for token in self.metadata.split(" "):
+            if token and "=" not in token:
+                return f"{token}.{self.index:04d}"
+
+        return f"{self.index:04d}"
+
+    def has_data(self, archive_size: int) -> bool:
+        return (self.location != 0xFFFFFFFF and self.file_size > 0 and
+                self.location + self.file_size <= archive_size)
+
+    def to_json(self, relative_to: str = "") -> dict:
+        return {
+            "Index": self.index,
+            "Location": self.location,
+            "SectorSize": self.sector_size,
+            "FileSize": self.file_size,
+            "FileName": self.name,
+            "Extension": self.extension,
+            "FileType": self.file_type,
+            "MetadataLocation": self.metadata_location,
+            "Unknown": self.unknown,
+            "Metadata": self.metadata,
+            "Path": os.path.relpath(self.path, relative_to).replace(os.sep, "/") if self.path else None,
+        }
+
+    def to_bytes(self, content_bitmask: int, entry_size: int, byteorder: str) -> bytes:
+        data: bytearray = bytearray()
+
+        if content_bitmask & contains_start_pointers:
+            data += self.location.to_bytes(4, byteorder)
+        if content_bitmask & contains_sector_sizes:
+            data += self.sector_size.to_bytes(4, byteorder)
+        if content_bitmask & contains_file_sizes:
+            data += self.file_size.to_bytes(4, byteorder)
+        if content_bitmask & contains_filenames:
+            data += self.name.encode("utf-8").ljust(0x20, b"\x00")[:0x20]
+        if content_bitmask & contains_file_extensions:
+            data += self.extension.encode("utf-8").ljust(0x8, b"\x00")[:0x8]
+        if content_bitmask & contains_file_types:
+            data += self.file_type.encode("utf-8").ljust(0x4, b"\x00")[:0x4]
+        if content_bitmask & contains_file_metadata:
+            data += self.metadata_location.to_bytes(4, byteorder)
+
+        for value in self.unknown:
+            data += value.to_bytes(4, byteorder)
+
+        return bytes(data.ljust(entry_size, b"\x00")[:entry_size])
+
+    @classmethod
+    def from_json(cls, data: dict, relative_to: str = ""):
+        entry = FPS4Entry(data["Index"], data["Location"], data["SectorSize"], data["FileSize"],
+                          data["FileName"], data["Extension"], data["FileType"], data["MetadataLocation"],
+                          data["Unknown"], data.get("Metadata", ""))
+
+        if data["Path"]:
+            entry.path = os.path.normpath(os.path.join(relative_to, data["Path"]))
+
+        return entry
+
+class FPS4Archive:
+    """
+    In-process reader for FPS4 Archives (.svo, .DAT and decompressed .tlzc files).
+    Archives nested in another file can be read in place by giving their offset and size within it.
+    """
+    def __init__(self, path: str, offset: int = 0, size: int = -1):
+        self.path: str = path
+        self.offset: int = offset
+        self.archive_size: int = size if size >= 0 else os.path.getsize(path) - offset
+        self.entries: list[FPS4Entry] = []
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+            header: bytes = f.read(fps4_header_size)
+            if len(header) < fps4_header_size or header[:4] != fps4_magic:
+                raise ValueError(f"{path} is not an FPS4 archive.")
+
+            # The header size is always 0x1C, which is used to detect the endianness of the archive
+            self.byteorder: str = "big" if int.from_bytes(header[0x8:0xC], "big") == fps4_header_size \
+                else "little"
+
+            self.file_count: int = self._read_int(header, 0x4, 4)
+            self.header_size: int = self._read_int(header, 0x8, 4)
+            self.first_file_start: int = self._read_int(header, 0xC, 4)
+            self.entry_size: int = self._read_int(header, 0x10, 2)
+            self.content_bitmask: int = self._read_int(header, 0x12, 2)
+            self.unknown2: int = self._read_int(header, 0x14, 4)
+            self.archive_name_location: int = self._read_int(header, 0x18, 4)
+
+            table_end: int = self.header_size + self.entry_size * self.file_count
+            if self.header_size != fps4_header_size or table_end > self.archive_size:
+                raise ValueError(f"{path} has a malformed FPS4 header.")
+
+            f.seek(offset + self.header_size)
+            table: bytes = f.read(self.entry_size * self.file_count)
+
+            # Archive name and member metadata strings live between the entry table and the first file
+            f.seek(offset + table_end)
+            self.header_data: bytes = f.read(max(0, self.first_file_start - table_end))
+
+        for index in range(self.file_count):
+            self.entries.append(self._parse_entry(index, table[index * self.entry_size:
+                                                               (index + 1) * self.entry_size]))
+
+    def _read_int(self, buffer: bytes, offset: int, size: int) -> int:
+        return int.from_bytes(buffer[offset:offset + size], self.byteorder)
+
+    def _read_string(self, offset: int) -> str:
+        relative: int = offset - self.header_size - self.entry_size * self.file_count
+        if not 0 <= relative < len(self.header_data):
+            return ""
+
+        end: int = self.header_data.find(b"\x00", relative)
+        return self.header_data[relative:end if end != -1 else None].decode("utf-8", errors="replace")
+
+    def _parse_entry(self, index: int, data: bytes) -> FPS4Entry:
+        entry: FPS4Entry = FPS4Entry(index)
+        position: int = 0
+
+        if self.content_bitmask & contains_start_pointers:
+            entry.location = self._read_int(data, position, 4)
+            position += 4
+        if self.content_bitmask & contains_sector_sizes:
+            entry.sector_size = self._read_int(data, position, 4)
+            position += 4
+        if self.content_bitmask & contains_file_sizes:
+            entry.file_size = self._read_int(data, position, 4)
+            position += 4
+        else:
+            entry.file_size = entry.sector_size
+        if self.content_bitmask & contains_filenames:
+            entry.name = data[position:position + 0x20].split(b"\x00")[0].decode("utf-8", errors="replace")
+            position += 0x20
+        if self.content_bitmask & contains_file_extensions:
+            entry.extension = data[position:position + 0x8].split(b"\x00")[0].decode("utf-8", errors="replace")
+            position += 0x8
+        if self.content_bitmask & contains_file_types:
+            entry.file_type = data[position:position + 0x4].split(b"\x00")[0].decode("utf-8", errors="replace")
+            position += 0x4
+        if self.content_bitmask & contains_file_metadata:
+            entry.metadata_location = self._read_int(data, position, 4)
+            entry.metadata = self._read_string(entry.metadata_location)
+            position += 4
+
+        while position + 4 <= len(data):
+            entry.unknown.append(self._read_int(data, position, 4))
+            position += 4
+
+        return entry
+
+    @property
+    def alignment(self) -> int:
+        members: list[FPS4Entry] = self.members()
+        locations: list[int] = [entry.location for entry in members]
+
+        # The end of a padded archive is aligned as well, which tells a 0x80 alignment apart from a lucky 0x100
+        if members and members[-1].location + members[-1].file_size != self.archive_size:
+            locations.append(self.archive_size)
+
+        return utils.common_alignment(locations)
+
+    def members(self) -> list[FPS4Entry]:
+        return [entry for entry in self.entries if entry.has_data(self.archive_size)]
+
+    def extract(self, out_dir: str, members: list[str] = None):
+        """Extract members of the archive to a directory. Only the named members are extracted if specified."""
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+
+        with open(self.path, "rb") as src:
+            for entry in self.members():
+                if members is not None and entry.filename not in members: continue
+                entry.path = os.path.join(out_dir, entry.filename)
+
+                src.seek(self.offset + entry.location)
+                with utils.write_atomic(entry.path) as dst:
+                    if utils.copy_range(src, dst, entry.file_size) != entry.file_size:
+                        raise ValueError(f"{self.path} ended unexpectedly while extracting {entry.filename}.")
+
+    def to_json(self, relative_to: str = "") -> dict:
+        return {
+            "Endian": self.byteorder,
+            "FileCount": self.file_count,
+            "HeaderSize": self.header_size,
+            "FirstFileStart": self.first_file_start,
+            "EntrySize": self.entry_size,
+            "ContentBitmask": self.content_bitmask,
+            "Unknown2": self.unknown2,
+            "ArchiveNameLocation": self.archive_name_location,
+            "ArchiveSize": self.archive_size,
+            "Alignment": self.alignment,
+            "HeaderData": self.header_data.hex(),
+            "Files": [entry.to_json(relative_to) for entry in self.entries],
+        }
+
+    def write_manifest(self, manifest: str):
+        manifest_dir: str = os.path.dirname(os.path.abspath(manifest))
+        if not os.path.isdir(manifest_dir):
+            os.makedirs(manifest_dir)
+
+        with open(manifest, "w") as f:
+            json.dump(self.to_json(manifest_dir), f, indent=4)
+
+    def find(self, filename: str) -> FPS4Entry:
+        for entry in self.members():
+            if entry.filename == filename:
+                return entry
+
+        raise ValueError(f"{filename} is not a member of {self.path}.")
+
+def locate(file: str, members: list[str]) -> tuple[int, int]:
+    """
+    Find the byte range of a member within an archive file, as (offset, size).
+    Members of nested archives are found by giving the name of each archive on the way to it.
+    """
+    offset: int = 0
+    size: int = -1
+    for filename in members:
+        entry: FPS4Entry = FPS4Archive(file, offset, size).find(filename)
+        offset += entry.location
+        size = entry.file_size
+
+    return offset, size
+
+def extract(file: str, out: str = "", manifest: str = ""):
+    """
+    Extract an FPS4 Archive the same way ToVfps4e does, defaulting to a '.ext' directory beside the archive.
+    Members are named like ToVfps4e names them, but the manifest uses the schema of pack(), see is_manifest.
+    """
+    archive: FPS4Archive = FPS4Archive(file)
+    archive.extract(out if out else file + ".ext")
+
+    if manifest:
+        archive.write_manifest(manifest)
+
+def pack(manifest_file: str, out: str = ""):
+    """Build an FPS4 Archive from a manifest written by extract(), streaming member data into the archive."""
+    with open(manifest_file, "r") as f:
+        manifest: dict = json.load(f)
+
+    manifest_dir: str = os.path.dirname(os.path.abspath(manifest_file))
+    output: str = out if out else manifest_file.removesuffix(".json")
+
+    byteorder: str = manifest["Endian"]
+    content_bitmask: int = manifest["ContentBitmask"]
+    entry_size: int = manifest["EntrySize"]
+    alignment: int = manifest["Alignment"]
+    first_file_start: int = manifest["FirstFileStart"]
+    header_data: bytes = bytes.fromhex(manifest["HeaderData"])
+
+    entries: list[FPS4Entry] = [FPS4Entry.from_json(data, manifest_dir) for data in manifest["Files"]]
+    members: list[FPS4Entry] = [entry for entry in entries if entry.path]
+
+    # Archives whose last member ends the file without padding are written the same way
+    pad_last: bool = bool(members) and members[-1].location + members[-1].file_size != manifest["ArchiveSize"]
+
+    position: int = first_file_start
+    for entry in members:
+        assert os.path.isfile(entry.path), f"Expected file {entry.path}, but it does not exist."
+
+        # Members whose sector size matched their file size are kept unpadded in the table
+        unpadded: bool = entry.sector_size == entry.file_size
+        entry.file_size = os.path.getsize(entry.path)
+        entry.location = position
+        entry.sector_size = entry.file_size if unpadded else -(-entry.file_size // alignment) * alignment
+
+        position += entry.file_size
+        if entry is not members[-1] or pad_last:
+            position += -entry.file_size % alignment
+
+    for entry in entries:
+        # The terminating entry points to the end of the archive
+        if not entry.path and entry.location >= manifest["ArchiveSize"]:
+            entry.location = position
+
+    header: bytes = (fps4_magic +
+                     len(entries).to_bytes(4, byteorder) +
+                     manifest["HeaderSize"].to_bytes(4, byteorder) +
+                     first_file_start.to_bytes(4, byteorder) +
+                     entry_size.to_bytes(2, byteorder) +
+                     content_bitmask.to_bytes(2, byteorder) +
+                     manifest["Unknown2"].to_bytes(4, byteorder) +
+                     manifest["ArchiveNameLocation"].to_bytes(4, byteorder))
+
+    table: bytes = b"".join(entry.to_bytes(content_bitmask, entry_size, byteorder) for entry in entries)
+
+    with utils.write_atomic(output) as dst:
+        dst.write(header)
+        dst.write(table)
+        dst.write(header_data)
+        dst.write(b"\x00" * (first_file_start - dst.tell()))
+
+        for entry in members:
+            with open(entry.path, "rb") as src:
+                shutil.copyfileobj(src, dst, utils.copy_buffer_size)
+
+            if entry is not members[-1] or pad_last:
+                dst.write(b"\x00" * (-entry.file_size % alignment))
+
+def is_manifest(manifest_file: str) -> bool:
+    """
+    Check if a manifest was written by extract(), rather than by ToVfps4e.
+    The two are not interchangeable: extract() writes its own schema, holding the raw header and table values needed to
+    rebuild the archive byte for byte, and only pack() reads it. Manifests written by ToVfps4e are left to ToVfps4p.
+    """
+    try:
+        with open(manifest_file, "r") as f:
+            return "ContentBitmask" in json.load(f)
+    except (OSError, ValueError):
+        return False
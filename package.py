@@ -0,0 +1,79 @@
+import zipfile
+import hashlib
+import json
+import os
+
+import utils
+
+package_extension: str = ".zip"
+package_manifest: str = ".package.json"
+
+zip64_threshold: int = 0x7FFFFFFF
+
+
+def is_package(path: str) -> bool:
+    return os.path.isfile(path) and zipfile.is_zipfile(path)
+
+def write(source_dir: str, out: str):
+    """
+    Bundle a patch output directory into a single uncompressed zip file.
+    The SHA-256 of every file is stored in a manifest at the end of the package, and computed while the files are
+    written, so every file is only read once.
+    """
+    digests: dict[str, str] = {}
+
+    with utils.write_atomic(out) as file, zipfile.ZipFile(file, "w", zipfile.ZIP_STORED) as archive:
+        for root, dirs, files in os.walk(source_dir):
+            dirs.sort()
+
+            for name in sorted(files):
+                path: str = os.path.join(root, name)
+                arcname: str = os.path.relpath(path, source_dir).replace(os.sep, "/")
+
+                info: zipfile.ZipInfo = zipfile.ZipInfo.from_file(path, arcname)
+                digest = hashlib.sha256()
+                with open(path, "rb") as src, archive.open(info, "w", force_zip64=info.file_size > zip64_threshold) as dst:
+                    while chunk := src.read(utils.copy_buffer_size):
+                        digest.update(chunk)
+                        dst.write(chunk)
+
+                digests[arcname] = digest.hexdigest()
+
+        archive.writestr(package_manifest, json.dumps({"files": digests}, indent=4))
+
+def extract(file: str, out_dir: str):
+    """
+    Extract a package written by write(), reading its members in the order they are stored, and verifying each file
+    against the hash in the manifest while it is being written.
+    """
+    out_dir = os.path.abspath(out_dir)
+
+    with zipfile.ZipFile(file, "r") as archive:
+        try:
+            digests: dict[str, str] = json.loads(archive.read(package_manifest))["files"]
+        except KeyError:
+            raise ValueError(f"{file} is not a patch package.")
+
+        for info in sorted(archive.infolist(), key=lambda member: member.header_offset):
+            if info.filename == package_manifest or info.is_dir(): continue
+
+            if info.filename not in digests:
+                raise ValueError(f"{info.filename} in {file} is missing from the package manifest.")
+
+            path: str = os.path.normpath(os.path.join(out_dir, *info.filename.split("/")))
+            if os.path.commonpath([out_dir, path]) != out_dir:
+                raise ValueError(f"{info.filename} in {file} points outside of the package.")
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            digest = hashlib.sha256()
+            with archive.open(info, "r") as src, open(path, "wb") as dst:
+                try:
+                    while chunk := src.read(utils.copy_buffer_size):
+                        digest.update(chunk)
+                        dst.write(chunk)
+                except zipfile.BadZipFile as e:
+                    raise ValueError(f"{e} in {file}, the package may be corrupted.")
+
+            if digest.hexdigest() != digests[info.filename]:
+                raise ValueError(f"{info.filename} in {file} does not match its hash, the package may be corrupted.")
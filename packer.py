@@ -1,21 +1,36 @@
 import subprocess
+import threading
+import multiprocessing
 import platform
-import hashlib
 import shutil
+import time
 import sys
 import os
 
+from concurrent.futures import ProcessPoolExecutor
+
 from vesperia_types import *
+import utils
+from runner import ToolError, ToolResult, tools
+from worker import HyoutaWorker
+import comptoe
+import package
+import fps4
+import scenario
+import tlzc
 
 
 # Configuraiton Files
 dependencies: str = "config.json"
+dependencies_cache: str = "config.cache.json"
 
 # Dependencies Default Directories
 dependency_vesperia = "vesperia"
 dependency_dotnet = "dotnet"
 dependency_hyouta = "hyouta"
 dependencies_comptoe = "comptoe"
+dependency_native = "native"
+dependency_partial_scenario = "partial_scenario"
 
 default_vesperia: str = os.path.join("steam", "steamapps", "common", "Tales of Vesperia Definitive Edition")
 default_backup: str = os.path.join(default_vesperia, "Data64", ".backup")
@@ -31,6 +46,21 @@ tov_npc = os.path.join("Data64", "npc.svo")
 tov_ui = os.path.join("Data64", "UI.svo")
 tov_scenario = os.path.join("Data64", "language", "scenario_ENG.dat")
 
+# Extractions of vanilla archives shared by every build, keyed by the archive checksum
+cache_dir: str = os.path.join(os.getcwd(), "cache")
+
+# Digest cache and record of backed up files, kept inside the backup directory
+hash_cache_file = ".hashes.json"
+backup_manifest_file = ".backup.json"
+applied_patch_file = ".applied.json"
+
+# Patched files are staged here before being swapped into the game directory
+staging_dir_name = ".staging"
+staging_journal_file = "journal.json"
+
+# Version of the patched output, to be raised whenever a change to the patcher changes the files it produces
+build_format_version: int = 1
+
 # Checksums
 checksums: dict[str, str] = {
     "TOV_DE.exe": "ee3212432d063c3551f8d5eb9c8dde6d55a22240912ae9ea3411b3808bfb3827",
@@ -45,12 +75,26 @@ class Hyouta:
     """Wrapper instance for HyoutaToolsCLI Commands"""
     dotnet: str = default_dotnet
     path: str = default_hyouta
+    native: bool = True
+    fast_compression: bool = False
+    worker: HyoutaWorker | None = None
 
-    def __init__(self, path: str, dotnet = "dotnet"):
+    def __init__(self, path: str, dotnet = "dotnet", native: bool = True):
         self.path: str = path
         self.dotnet: str = dotnet
+        self.native: bool = native
+
+        # dotnet is only needed on Windows or when running HyoutaToolsCLI from its dll
+        self.use_dotnet: bool = bool(dotnet) and (platform.system() == "Windows" or path.endswith(".dll"))
 
-        self.use_dotnet: bool = bool(dotnet)
+    def fingerprint(self) -> dict:
+        dotnet: str | None = shutil.which(self.dotnet) if self.use_dotnet else None
+
+        return {
+            "hyouta": utils.stat_fingerprint(self.path),
+            "dotnet": utils.stat_fingerprint(dotnet) if dotnet else None,
+            "use_dotnet": self.use_dotnet,
+        }
 
     def check_dependencies(self) -> bool:
         error_occurred: bool = False
@@ -73,8 +117,6 @@ class Hyouta:
             except FileNotFoundError:
                 error_occurred = True
                 print("Missing Dependency: .NET 6.0 is not installed, or is not present in the provided path.")
-        else:
-            self.use_dotnet: bool = False
 
         try:
             if self.use_dotnet:
@@ -116,7 +158,39 @@ class Hyouta:
 
         return command
 
+    def start_worker(self):
+        """Keep a single HyoutaToolsCLI host alive for all following commands, if the host can be embedded."""
+        if self.worker is not None or not self.use_dotnet or not HyoutaWorker.is_supported(self.path):
+            return
+
+        worker: HyoutaWorker = HyoutaWorker(self.path)
+        if worker.start():
+            self.worker = worker
+
+    def stop_worker(self):
+        if self.worker is None: return
+
+        self.worker.stop()
+        self.worker = None
+
+    def execute(self, command: list[str]) -> ToolResult:
+        if self.worker is None:
+            return tools.run(command)
+
+        result: ToolResult = self.worker.run(command, command[len(self.build_base_command()):])
+        if not result.ok:
+            raise ToolError(result)
+
+        return result
+
     def extract_svo(self, file: str, out: str="", manifest:str = ""):
+        if self.native:
+            try:
+                fps4.extract(file, out, manifest + ".json" if manifest else "")
+                return
+            except ValueError as e:
+                print(f"> {e} Falling back to HyoutaToolsCLI...")
+
         command: list[str] = self.build_base_command("ToVfps4e", file)
 
         if out:
@@ -125,59 +199,53 @@ class Hyouta:
         if manifest:
             command.extend(["-j", manifest + ".json"])
 
-        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-        if result.stderr:
-            print(result.stderr)
-            print("> Aborting Patch...")
-            sys.exit(1)
+        self.execute(command)
 
     def decompress_tlzc(self, file: str, out: str=""):
+        if self.native:
+            try:
+                tlzc.decompress_file(file, out)
+                return
+            except ValueError as e:
+                print(f"> {e} Falling back to HyoutaToolsCLI...")
+
         command: list[str] = self.build_base_command("tlzc", "-d", file, out)
 
-        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-        if result.stderr:
-            print(result.stderr)
-            print("> Aborting Patch...")
-            sys.exit(1)
+        self.execute(command)
 
     def extract_scenario(self, file: str, dir_out: str=""):
         command: list[str] = self.build_base_command("Tales.Vesperia.Scenario.Extract", file, dir_out)
 
-        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-        if result.stderr:
-            print(result.stderr)
-            print("> Aborting Patch...")
-            sys.exit(1)
+        self.execute(command)
 
     def pack_svo(self, manifest_file: str, out: str=""):
+        if fps4.is_manifest(manifest_file):
+            fps4.pack(manifest_file, out)
+            return
+
         command: list[str] = self.build_base_command("ToVfps4p", manifest_file)
 
         if out:
             command.append(out)
 
-        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-        if result.stderr:
-            print(result.stderr)
-            print("> Aborting Patch...")
-            sys.exit(1)
+        self.execute(command)
 
     def compress_tlzc(self, file: str, out: str=""):
+        if self.native:
+            try:
+                tlzc.compress_file(file, out, fast=self.fast_compression)
+                return
+            except ValueError as e:
+                print(f"> {e} Falling back to HyoutaToolsCLI...")
+
         command: list[str] = self.build_base_command("tlzc", "-c", file, out)
 
-        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-        if result.stderr:
-            print(result.stderr)
-            print("> Aborting Patch...")
-            sys.exit(1)
+        self.execute(command)
 
     def pack_scenario(self, file: str, dir_out: str=""):
         command: list[str] = self.build_base_command("Tales.Vesperia.Scenario.Pack", file, dir_out)
 
-        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-        if result.stderr:
-            print(result.stderr)
-            print("> Aborting Patch...")
-            sys.exit(1)
+        self.execute(command)
 
 class VesperiaPacker:
     """Handler Instance for Extraction, Packing, Compressing and Decompressing files from the game."""
@@ -185,6 +253,14 @@ class VesperiaPacker:
     backup_dir: str = default_backup
     comptoe: str = default_comptoe
     hyouta: Hyouta
+    native: bool = True
+    partial_scenario: bool = False
+    hash_cache: utils.HashCache
+    backup_lock: threading.Lock
+    # Build directories holding only some members of their archive, with the archive and the extracted members
+    partial_builds: dict[str, tuple[str, set[str]]]
+    # Held for the whole run, so two runs of the same patch never work in the same build and output directories
+    output_lock = None
 
     build_dir: str = os.path.join(os.getcwd(), "builds")
     manifest_dir: str = os.path.join(build_dir, "manifests")
@@ -192,8 +268,11 @@ class VesperiaPacker:
 
     apply_immediately: bool = False
 
-    def __init__(self, patch_id: str = "singleton", apply_immediately: bool = False):
+    def __init__(self, patch_id: str = "singleton", apply_immediately: bool = False, fast_compression: bool = False,
+                 recheck: bool = False):
         config_present: bool = os.path.isfile(dependencies)
+        self.partial_builds = {}
+        self.backup_lock = threading.Lock()
 
         if not config_present:
             VesperiaPacker.generate_config()
@@ -216,16 +295,33 @@ class VesperiaPacker:
             if dependencies_comptoe in data and data[dependencies_comptoe]:
                 self.comptoe = data[dependencies_comptoe]
 
+            # In-process implementations are used for supported formats unless explicitly disabled
+            self.native = bool(data.get(dependency_native, True))
+            # Rewriting single members of the scenario container in-process is opt-in
+            self.partial_scenario = self.native and bool(data.get(dependency_partial_scenario, False))
+
             if hyouta_dir:
-                self.hyouta = Hyouta(hyouta_dir, dotnet_dir)
+                self.hyouta = Hyouta(hyouta_dir, dotnet_dir, self.native)
+                self.hyouta.fast_compression = fast_compression
 
             file.close()
 
+        # Kept outside of the backup folder, which must only exist once something has actually been backed up
+        self.hash_cache = utils.HashCache(os.path.join(cache_dir, hash_cache_file))
+
         # Enforce use of dotnet6.x with a global.json
         if self.hyouta.use_dotnet and not os.path.isfile(os.path.join(os.getcwd(), "global.json")):
             self.generate_global()
 
-        dependencies_error: bool = self.check_dependencies()
+        # Probing runs every tool and hashes the executable, so it is skipped if nothing changed since the last success
+        fingerprint: dict = self.dependencies_fingerprint()
+        dependencies_error: bool = False
+        if recheck or not self.is_probe_cached(fingerprint):
+            dependencies_error = self.check_dependencies()
+
+            if not dependencies_error:
+                self.cache_probe(fingerprint)
+
         if dependencies_error:
             if not config_present:
                 print("\n> Some dependencies could not be automatically detected.\n"
@@ -255,14 +351,45 @@ class VesperiaPacker:
 
         self.output_dir = os.path.join(self.output_dir, patch_id)
 
+        self.output_lock = utils.try_lock(self.output_dir + ".lock")
+        if self.output_lock is None:
+            print("> This patch is already being built by another run, waiting for it to finish...")
+            while self.output_lock is None:
+                time.sleep(1)
+                self.output_lock = utils.try_lock(self.output_dir + ".lock")
+
         self.apply_immediately = apply_immediately
 
-        if os.path.isdir(self.output_dir) and apply_immediately:
+        # Builds are identified by what they produce, so a finished output is reused as-is
+        finished: str = self.finished_output()
+        if finished:
             print("> The patched game files for this patch file has already been generated.")
-            self.apply_patch()
-            print("> Applied patch to game directory.")
+            if apply_immediately:
+                try:
+                    self.apply_patch(finished)
+                except ValueError as e:
+                    print(f"<!> {e}")
+                    self.recover_staging()
+                    sys.exit(1)
+
+                print("> Applied patch to game directory.")
+            else:
+                print(f"Patch Output: {finished}")
             sys.exit(0)
 
+        # Anything left in the output was written by a build that did not finish
+        if os.path.isdir(self.output_dir):
+            shutil.rmtree(self.output_dir)
+
+    @staticmethod
+    def config_setting(key: str, default: bool) -> bool:
+        """Read a single switch from the config, without loading the rest of it"""
+        if not os.path.isfile(dependencies):
+            return default
+
+        with open(dependencies, "r") as file:
+            return bool(json.load(file).get(key, default))
+
     @classmethod
     def generate_config(cls):
         system: str = platform.system()
@@ -280,7 +407,9 @@ class VesperiaPacker:
 
         config = {
             dependency_vesperia : vesperia,
-            dependencies_comptoe: default_comptoe + (".exe" if platform == "Windows" else "")
+            dependencies_comptoe: default_comptoe + (".exe" if platform == "Windows" else ""),
+            dependency_native: True,
+            dependency_partial_scenario: False
         }
 
         if dotnet_required:
@@ -306,16 +435,36 @@ class VesperiaPacker:
         with open(global_file, "w") as file:
             json.dump(dotnet_global, file, indent=4)
 
+    def dependencies_fingerprint(self) -> dict:
+        return {
+            "vesperia": utils.stat_fingerprint(os.path.join(self.vesperia_dir, tov_executable)),
+            "comptoe": utils.stat_fingerprint(self.comptoe) if not self.native else None,
+            "native": self.native,
+            **self.hyouta.fingerprint(),
+        }
+
+    @staticmethod
+    def is_probe_cached(fingerprint: dict) -> bool:
+        if not os.path.isfile(dependencies_cache):
+            return False
+
+        try:
+            with open(dependencies_cache, "r") as file:
+                return json.load(file) == fingerprint
+        except ValueError:
+            return False
+
+    @staticmethod
+    def cache_probe(fingerprint: dict):
+        with open(dependencies_cache, "w") as file:
+            json.dump(fingerprint, file, indent=4)
+
     def check_dependencies(self):
         error_occurred: bool = False
 
         try:
-            with open(os.path.join(self.vesperia_dir, "TOV_DE.exe"), "rb") as file:
-                as_bytes = file.read()
-                exec_hash = hashlib.sha256(as_bytes).hexdigest()
-
-                assert exec_hash == checksums["TOV_DE.exe"]
-                file.close()
+            exec_hash: str = self.hash_cache.sha256(os.path.join(self.vesperia_dir, "TOV_DE.exe"))
+            assert exec_hash == checksums["TOV_DE.exe"]
         except AssertionError:
             error_occurred = True
             print("Wrong Dependency: The provided game executable did not meet the expected supported version."
@@ -326,6 +475,10 @@ class VesperiaPacker:
 
         error_occurred = self.hyouta.check_dependencies() or error_occurred
 
+        # comptoe is only required when the in-process codec is disabled
+        if self.native:
+            return error_occurred
+
         try:
             if not os.path.isfile(self.comptoe): raise FileNotFoundError
 
@@ -349,97 +502,195 @@ class VesperiaPacker:
 
         return error_occurred
 
-    @staticmethod
-    def verify_vesperia_file(filepath: str) -> bool:
+    def verify_vesperia_file(self, filepath: str) -> bool:
         basename = os.path.basename(filepath)
 
         try:
-            with open(filepath, "rb") as file:
-                as_bytes = file.read()
-                file_hash = hashlib.sha256(as_bytes).hexdigest()
-
-                assert file_hash == checksums[basename]
-
-                file.close()
+            file_hash: str = self.hash_cache.sha256(filepath)
+            assert file_hash == checksums[basename]
         except AssertionError:
             print(f"Invalid File: {basename} may have already been patched, modified, or may be corrupted.")
             return False
 
         return True
 
-    def check_vesperia_file(self, original_path: str) -> str:
-        basename: str = os.path.basename(original_path)
+    def get_backup_path(self, original_path: str) -> str:
         basedir: str = os.path.splitroot(original_path.split('Data64', maxsplit=1)[-1])[-1]
-        backup_path: str = os.path.join(self.backup_dir, basedir)
+        return os.path.join(self.backup_dir, basedir)
 
-        if os.path.isfile(backup_path) and self.verify_vesperia_file(backup_path):
-            if self.apply_immediately and os.path.isfile(original_path):
-                os.remove(original_path)
+    def has_backup(self) -> bool:
+        """Check for backed up game files, ignoring the sidecar files kept beside them"""
+        sidecars: set[str] = {hash_cache_file, backup_manifest_file, applied_patch_file}
+        for _, _, files in os.walk(self.backup_dir):
+            if any(name not in sidecars for name in files):
+                return True
+
+        return False
+
+    def load_backup_manifest(self) -> dict:
+        path: str = os.path.join(self.backup_dir, backup_manifest_file)
+        if not os.path.isfile(path):
+            return {}
+
+        try:
+            with open(path, "r") as file:
+                return json.load(file)
+        except ValueError:
+            return {}
+
+    def record_backup(self, backup_path: str, digest: str, method: str):
+        """Add a backed up file and its verified hash to the backup manifest"""
+        self.hash_cache.record(backup_path, digest)
+
+        relative: str = os.path.relpath(backup_path, self.backup_dir).replace(os.sep, "/")
+        with self.backup_lock:
+            manifest: dict = self.load_backup_manifest()
+            manifest[relative] = {
+                "sha256": digest,
+                "size": os.path.getsize(backup_path),
+                "method": method,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+
+            path: str = os.path.join(self.backup_dir, backup_manifest_file)
+            with utils.write_atomic(path, "w") as file:
+                json.dump(manifest, file, indent=4)
 
+    def find_vesperia_file(self, original_path: str) -> str:
+        """Get the path of the verified copy of a game file, preferring its backup, without moving anything"""
+        basename: str = os.path.basename(original_path)
+        backup_path: str = self.get_backup_path(original_path)
+
+        if os.path.isfile(backup_path) and self.verify_vesperia_file(backup_path):
             return backup_path
         elif os.path.isfile(original_path):
             assert self.verify_vesperia_file(original_path), \
                 f"Invalid File: {basename} may have already been patched, modified, or may be corrupted."
 
-            if not os.path.isdir(self.backup_dir):
-                os.makedirs(self.backup_dir)
-
-            if not os.path.isdir(os.path.dirname(backup_path)):
-                os.makedirs(os.path.dirname(backup_path))
+            return original_path
+        else:
+            raise AssertionError(f"{basename} could not be found in the game directory.")
 
-            shutil.copy2(original_path, backup_path)
+    def check_vesperia_file(self, original_path: str) -> str:
+        basename: str = os.path.basename(original_path)
+        backup_path: str = self.get_backup_path(original_path)
 
-            if self.apply_immediately:
+        if self.find_vesperia_file(original_path) == backup_path:
+            if self.apply_immediately and os.path.isfile(original_path):
                 os.remove(original_path)
 
             return backup_path
-        else:
-            raise AssertionError(f"{basename} could not be found in the game directory.")
+
+        # Files may be checked from several threads at once
+        os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+
+        # The backup shares the data of the original, which is moved instead if it is going to be replaced
+        method: str = utils.move_file(original_path, backup_path, keep_source=not self.apply_immediately)
+        self.record_backup(backup_path, checksums[basename], method)
+
+        return backup_path
 
     def ensure_output_directory(self):
         if not os.path.isdir(self.output_dir):
             os.makedirs(self.output_dir)
 
-    def comptoe_decompress(self, file: str, out: str = ""):
-        command: list[str] = [self.comptoe, "-d", file]
+    def build_comptoe_command(self, mode: str, file: str, out: str = "") -> list[str]:
+        command: list[str] = [self.comptoe, mode, file]
 
         if out:
             command.append(out)
 
-        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-        if result.stderr:
-            print(result.stderr)
-            print("> Aborting Patch...")
-            sys.exit(1)
+        return command
 
-    def comptoe_compress(self, file: str, out: str = ""):
-        command: list[str] = [self.comptoe, "-c", file]
+    def comptoe_decompress(self, file: str, out: str = ""):
+        if self.native:
+            try:
+                comptoe.decompress_file(file, out)
+                return
+            except ValueError as e:
+                print(f"> {e} Falling back to comptoe...")
 
-        if out:
-            command.append(out)
+        tools.run(self.build_comptoe_command("-d", file, out))
+
+    def comptoe_compress(self, file: str, out: str = ""):
+        if self.native:
+            try:
+                comptoe.compress_file(file, out)
+                return
+            except ValueError as e:
+                print(f"> {e} Falling back to comptoe...")
 
-        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-        if result.stderr:
-            print(result.stderr)
-            print("> Aborting Patch...")
-            sys.exit(1)
+        tools.run(self.build_comptoe_command("-c", file, out))
 
     def set_build_dir(self, build_dir: str):
         self.build_dir = build_dir
 
+    def extract_pristine(self, path: str, out: str, extract):
+        """
+        Seed a build directory with the vanilla contents of a verified archive.
+        The archive is only extracted the first time, into a cache shared by all builds, and the files are then linked
+        into each build. Files from the cache must be unshared before they are modified in place.
+        """
+        utils.clone_tree(self.seed_cache(path, extract), out)
+
+    @staticmethod
+    def seed_cache(path: str, extract) -> str:
+        """Extract a verified archive into the shared cache if it is not there yet. Returns the path of the cache."""
+        cache_path: str = os.path.join(cache_dir, checksums[os.path.basename(path)])
+
+        if not os.path.isdir(cache_path):
+            temp_path: str = f"{cache_path}.{os.getpid()}.tmp"
+            shutil.rmtree(temp_path, ignore_errors=True)
+            os.makedirs(temp_path)
+
+            try:
+                extract(temp_path)
+            except BaseException:
+                shutil.rmtree(temp_path, ignore_errors=True)
+                raise
+
+            try:
+                os.rename(temp_path, cache_path)
+            except OSError:
+                # Another run finished extracting the same archive first
+                shutil.rmtree(temp_path, ignore_errors=True)
+
+        return cache_path
+
     def unpack_btl(self):
         path: str = self.check_vesperia_file(os.path.join(self.vesperia_dir, tov_btl))
 
         base_build: str = os.path.join(self.build_dir, "btl")
-        if not os.path.isfile(path):
-            os.mkdir(base_build)
-
-        self.hyouta.extract_svo(path, base_build)
+        self.extract_pristine(path, base_build, lambda out: self.hyouta.extract_svo(path, out))
 
         pack_build: str = os.path.join(self.build_dir, "BTL_PACK")
         self.hyouta.extract_svo(os.path.join(base_build, "BTL_PACK.DAT"), pack_build,
                                 os.path.join(self.manifest_dir, "BTL_PACK.DAT"))
 
+    def unpack_btl_in_place(self) -> str:
+        """
+        Prepare the btl output for patching BTL_PACK.DAT directly, without extracting or repacking its members.
+        Returns the path to the copy of BTL_PACK.DAT in the output, which is safe to modify in place.
+        """
+        path: str = self.check_vesperia_file(os.path.join(self.vesperia_dir, tov_btl))
+
+        base_build: str = os.path.join(self.build_dir, "btl")
+        self.extract_pristine(path, base_build, lambda out: self.hyouta.extract_svo(path, out))
+
+        self.ensure_output_directory()
+        output_dir: str = os.path.join(self.output_dir, "Data64", "btl")
+        utils.clone_tree(base_build, output_dir, ignore=shutil.ignore_patterns("BTL_PACK.DAT"))
+
+        output: str = os.path.join(output_dir, "BTL_PACK.DAT")
+        utils.clone_file(os.path.join(base_build, "BTL_PACK.DAT"), output, link=False)
+
+        return output
+
+    @staticmethod
+    def locate_member(path: str, members: list[str]) -> tuple[str, int, int]:
+        """Find where a member nested in FPS4 archives is stored in a file, as (file, offset, size)"""
+        return path, *fps4.locate(path, members)
+
     def extract_artes(self):
         path: str = os.path.join(self.build_dir, "BTL_PACK", "0004")
         assert os.path.isfile(path), f"Expected file {path}, but it does not exist."
@@ -457,17 +708,49 @@ class VesperiaPacker:
         assert os.path.isfile(path), f"Expected file {path}, but it does not exist."
 
         base_build: str = os.path.join(self.build_dir, "item")
-        if not os.path.isdir(base_build):
-            os.makedirs(base_build)
+        self.extract_pristine(path, base_build, lambda out: self.hyouta.extract_svo(path, out))
 
-        self.hyouta.extract_svo(path, base_build)
-
-    def unpack_npc(self):
+    def unpack_npc(self, maps: list[str] = None):
+        """
+        Extract npc.svo into the build directory. If maps are given, only their data files are extracted,
+        and copy_to_output fills in the rest of the archive.
+        """
         path: str = self.check_vesperia_file(os.path.join(self.vesperia_dir, tov_npc))
         base_build: str = os.path.join(self.build_dir, "npc")
         assert os.path.isfile(path), f"Expected file {path}, but it does not exist."
 
-        self.hyouta.extract_svo(path, base_build)
+        if maps is not None and self.native:
+            members: set[str] = {(name if name.endswith(".DAT") else name + ".DAT") for name in maps}
+
+            try:
+                # The whole archive is still cached once, so complete_output can link the unchanged members
+                cache_path: str = self.seed_cache(path, lambda out: fps4.FPS4Archive(path).extract(out))
+
+                os.makedirs(base_build, exist_ok=True)
+                for member in members:
+                    utils.clone_file(os.path.join(cache_path, member), os.path.join(base_build, member))
+
+                self.partial_builds["npc"] = (path, members)
+                return
+            except (ValueError, FileNotFoundError) as e:
+                print(f"> {e} Extracting all of npc.svo instead...")
+
+        self.extract_pristine(path, base_build, lambda out: self.hyouta.extract_svo(path, out))
+
+    def complete_output(self, dir_name: str):
+        """Add the members of an archive that were left out of a partial build to its output, unchanged"""
+        path, members = self.partial_builds[dir_name]
+        output_dir: str = os.path.join(self.output_dir, "Data64", dir_name)
+        cache_path: str = os.path.join(cache_dir, checksums[os.path.basename(path)])
+
+        if os.path.isdir(cache_path):
+            for name in os.listdir(cache_path):
+                if name in members: continue
+                utils.clone_file(os.path.join(cache_path, name), os.path.join(output_dir, name))
+        else:
+            # Stream the unchanged members straight from the archive, without staging them in the build
+            archive: fps4.FPS4Archive = fps4.FPS4Archive(path)
+            archive.extract(output_dir, [entry.filename for entry in archive.members() if entry.filename not in members])
 
     def extract_map(self, map_data: str):
         data_name: str = map_data if not map_data.endswith(".DAT") else map_data.replace(".DAT", "")
@@ -499,7 +782,11 @@ class VesperiaPacker:
 
         self.hyouta.extract_svo(path, work_dir)
 
-    def extract_scenario(self, lang = "ENG"):
+    def extract_scenario(self, lang = "ENG", members: list[str] = None):
+        """
+        Extract the scenario container into the build directory. If members are given, only those are extracted,
+        and pack_scenario writes them back into a copy of the original container.
+        """
         # target: str = f"scenario_{lang}.dat"
         path: str = self.check_vesperia_file(os.path.join(self.vesperia_dir, tov_scenario))
         assert os.path.isfile(path), f"Expected file {path}, but it does not exist."
@@ -508,9 +795,16 @@ class VesperiaPacker:
         if not os.path.isdir(work_dir): os.mkdir(work_dir)
 
         extract_dir: str = os.path.join(work_dir, "." + lang)
-        if not os.path.isdir(extract_dir): os.mkdir(extract_dir)
 
-        self.hyouta.extract_scenario(path, extract_dir)
+        if members is not None and self.partial_scenario:
+            try:
+                scenario.ScenarioArchive(path).extract(extract_dir, members)
+                self.partial_builds["language"] = (path, set(members))
+                return
+            except ValueError as e:
+                print(f"> {e} Extracting all of {os.path.basename(path)} instead...")
+
+        self.extract_pristine(path, extract_dir, lambda out: self.hyouta.extract_scenario(path, out))
 
     def decompress_scenario(self, file: str, lang: str = "ENG"):
         assert file, f"Unexpected empty file entry."
@@ -527,7 +821,22 @@ class VesperiaPacker:
         decompress_dir: str = os.path.join(work_dir, f".{lang}.dec")
         if not os.path.isdir(decompress_dir): os.mkdir(decompress_dir)
 
-        self.comptoe_decompress(target, os.path.join(decompress_dir, file + ".dec"))
+        output: str = os.path.join(decompress_dir, file + ".dec")
+        self.comptoe_decompress(target, output)
+
+        # Remember the unmodified contents, so pack_scenario only recompresses members that were patched
+        digests: dict = self.load_scenario_digests(lang)
+        digests[file + ".dec"] = utils.file_sha256(output)
+        with utils.write_atomic(os.path.join(work_dir, f".{lang}.dec.json"), "w") as f:
+            json.dump(digests, f, indent=4)
+
+    def load_scenario_digests(self, lang: str = "ENG") -> dict:
+        path: str = os.path.join(self.build_dir, "language", f".{lang}.dec.json")
+        if not os.path.isfile(path):
+            return {}
+
+        with open(path, "r") as f:
+            return json.load(f)
 
     def pack_btl(self):
         path: str = os.path.join(self.manifest_dir, "BTL_PACK.DAT.json")
@@ -536,7 +845,8 @@ class VesperiaPacker:
         self.ensure_output_directory()
         output_dir: str = os.path.join(self.output_dir, "Data64", "btl")
 
-        shutil.copytree(os.path.join(self.build_dir, "btl"), output_dir, dirs_exist_ok=True)
+        # BTL_PACK.DAT is rebuilt below, so it is left out instead of being linked and then overwritten
+        utils.clone_tree(os.path.join(self.build_dir, "btl"), output_dir, ignore=shutil.ignore_patterns("BTL_PACK.DAT"))
         self.hyouta.pack_svo(path, os.path.join(output_dir, "BTL_PACK.DAT"))
 
     def pack_artes(self):
@@ -567,6 +877,7 @@ class VesperiaPacker:
         self.hyouta.pack_svo(manifest, os.path.join(work_dir, data_name + ".tlzc"))
 
         data_file: str = os.path.join(self.build_dir, "npc", data_name + ".DAT")
+        utils.unshare(data_file)
         self.hyouta.compress_tlzc(map_decompressed, data_file)
 
     def compress_data(self, file: str, out: str = ""):
@@ -590,22 +901,69 @@ class VesperiaPacker:
         assert os.path.isdir(main), f"Expected directory {path}, but it does not exist."
         assert os.path.isdir(dec), f"Expected file {dec}, but it does not exist."
 
+        original_digests: dict = self.load_scenario_digests(lang)
+
+        jobs: list[tuple[str, str]] = []
         for dec_file in os.listdir(dec):
             file: str = os.path.join(dec, f"{dec_file}")
             out: str = os.path.join(main, dec_file.split(".")[0])
 
             if not os.path.isfile(file): continue
 
-            self.comptoe_compress(file, out)
+            # Unmodified members keep their original compressed data
+            if original_digests.get(dec_file) == utils.file_sha256(file): continue
+
+            utils.unshare(out)
+            jobs.append((file, out))
+
+        if self.native and len(jobs) > 1:
+            # Compression is CPU bound Python code, so it is spread over processes rather than threads. Processes are
+            # spawned rather than forked, as forking copies the tool runner and worker threads of this process
+            with ProcessPoolExecutor(max_workers=min(len(jobs), tools.max_concurrency),
+                                     mp_context=multiprocessing.get_context("spawn")) as executor:
+                futures: dict = {executor.submit(comptoe.compress_file, file, out): (file, out) for file, out in jobs}
+
+            for future, (file, out) in futures.items():
+                try:
+                    future.result()
+                except ValueError as e:
+                    print(f"> {e} Falling back to comptoe...")
+                    tools.run(self.build_comptoe_command("-c", file, out))
+        elif self.native:
+            for file, out in jobs:
+                self.comptoe_compress(file, out)
+        else:
+            # Let the external compressions overlap, bounded by the shared tool runner
+            for future in [tools.submit(self.build_comptoe_command("-c", file, out)) for file, out in jobs]:
+                future.result()
 
         self.ensure_output_directory()
         output_dir: str = os.path.join(self.output_dir, "Data64", "language")
         if not os.path.isdir(output_dir):
             os.makedirs(output_dir)
 
-        shutil.copytree(path, output_dir, dirs_exist_ok=True, ignore=shutil.ignore_patterns(".*"))
+        utils.clone_tree(path, output_dir, ignore=shutil.ignore_patterns(".*"))
 
         output: str = os.path.join(output_dir, "scenario_ENG.dat")
+        if "language" in self.partial_builds:
+            # Only the recompressed members are replaced, everything else is copied from the original container
+            source, _ = self.partial_builds["language"]
+            archive: scenario.ScenarioArchive = scenario.ScenarioArchive(source)
+            replacements: dict[int, str] = {int(os.path.basename(out)): out for _, out in jobs}
+
+            try:
+                archive.write(output, replacements)
+                archive.verify(output, replacements)
+                return
+            except ValueError as e:
+                print(f"> {e} Packing {os.path.basename(source)} with HyoutaToolsCLI instead...")
+
+            # The rest of the container is extracted after all, with the patched members laid over it
+            full: str = main + ".full"
+            self.extract_pristine(source, full, lambda out: self.hyouta.extract_scenario(source, out))
+            utils.clone_tree(main, full)
+            main = full
+
         self.hyouta.pack_scenario(main, output)
 
     def copy_to_output(self, dir_name: str, ):
@@ -614,32 +972,171 @@ class VesperiaPacker:
 
         self.ensure_output_directory()
 
-        shutil.copytree(target, os.path.join(self.output_dir, "Data64", dir_name), dirs_exist_ok=True)
+        # Unchanged files are linked rather than copied, and only take up space once across all builds and outputs
+        utils.clone_tree(target, os.path.join(self.output_dir, "Data64", dir_name))
+
+        if dir_name in self.partial_builds:
+            self.complete_output(dir_name)
 
     def apply_patch(self, custom_output: str = ""):
+        """
+        Install a patch output into the game directory.
+        The patched files are first staged beside the live ones, then swapped in by renaming, with a journal of the
+        swap so an interrupted apply is rolled back on the next run instead of leaving a half patched game.
+        """
         if not custom_output and not self.apply_immediately:
             return
 
         print("> Applying Patch...")
+        patched_path: str = custom_output if custom_output else self.output_dir
+
+        self.recover_staging()
 
-        if custom_output:
-            self.prepare_game(custom_output)
-            shutil.copytree(custom_output, self.vesperia_dir, dirs_exist_ok=True)
+        data_dir: str = os.path.join(self.vesperia_dir, "Data64")
+        staging_dir: str = os.path.join(data_dir, staging_dir_name)
+        new_dir: str = os.path.join(staging_dir, "new")
+        old_dir: str = os.path.join(staging_dir, "old")
+
+        # Staged files are reflinked or copied from the output, never hardlinked, so the installed files do not share
+        # their data with the outputs and the cache, and modifying them in the game directory cannot change either
+        if package.is_package(patched_path):
+            package.extract(patched_path, new_dir)
         else:
-            shutil.copytree(self.output_dir, self.vesperia_dir, dirs_exist_ok=True)
+            utils.clone_tree(os.path.join(patched_path, "Data64"), os.path.join(new_dir, "Data64"), link=False)
+
+        installed, replaced = self.overlay_entries(new_dir)
+
+        journal: dict = {"installed": sorted(installed), "displaced": sorted(installed | replaced)}
+        journal_path: str = os.path.join(staging_dir, staging_journal_file)
+        with utils.write_atomic(journal_path, "w") as file:
+            json.dump(journal, file, indent=4)
+
+        for relative in journal["displaced"]:
+            live_path: str = os.path.join(data_dir, relative)
+            if not os.path.lexists(live_path): continue
+
+            os.makedirs(os.path.dirname(os.path.join(old_dir, relative)), exist_ok=True)
+            os.rename(live_path, os.path.join(old_dir, relative))
+
+        for relative in journal["installed"]:
+            live_path: str = os.path.join(data_dir, relative)
+            os.makedirs(os.path.dirname(live_path), exist_ok=True)
+            os.rename(os.path.join(new_dir, "Data64", relative), live_path)
+
+        # Commit point of the swap, anything left in the staging directory from here on is only cleaned up
+        os.remove(journal_path)
+
+        self.record_applied(installed, replaced)
+        shutil.rmtree(staging_dir)
+
+    def recover_staging(self):
+        """Roll back a swap that was interrupted, putting the displaced game files back where they were"""
+        staging_dir: str = os.path.join(self.vesperia_dir, "Data64", staging_dir_name)
+        journal_path: str = os.path.join(staging_dir, staging_journal_file)
+
+        if os.path.isfile(journal_path):
+            print("> Rolling back an interrupted patch...")
+            with open(journal_path, "r") as file:
+                journal: dict = json.load(file)
+
+            data_dir: str = os.path.join(self.vesperia_dir, "Data64")
+            for relative in journal["installed"]:
+                live_path: str = os.path.join(data_dir, relative)
+
+                # Only entries that already left the staging directory were swapped in
+                if os.path.lexists(os.path.join(staging_dir, "new", "Data64", relative)) or \
+                        not os.path.lexists(live_path):
+                    continue
+
+                if os.path.isdir(live_path) and not os.path.islink(live_path):
+                    shutil.rmtree(live_path)
+                else:
+                    os.remove(live_path)
+
+            for relative in journal["displaced"]:
+                old_path: str = os.path.join(staging_dir, "old", relative)
+                if os.path.lexists(old_path):
+                    os.rename(old_path, os.path.join(data_dir, relative))
+
+        # Without a journal, the swap either never started or already finished, and the staging directory is garbage
+        if os.path.isdir(staging_dir):
+            shutil.rmtree(staging_dir)
+
+    @staticmethod
+    def overlay_entries(patched_path: str) -> tuple[set[str], set[str]]:
+        """
+        Get the paths a patch output installs into Data64, and the original files they replace.
+        Folders of unpacked archives are installed as a whole, and replace their archive.
+        """
+        installed: set[str] = set()
+        replaced: set[str] = set()
 
-    def prepare_game(self, patched_path: str):
         data_dir: str = os.path.join(patched_path, "Data64")
-        contents: list[str] = os.listdir(data_dir)
+        for root, dirs, files in os.walk(data_dir):
+            relative_root: str = os.path.relpath(root, data_dir)
 
-        if "btl" in contents:
-            os.remove(os.path.join(self.vesperia_dir, tov_btl))
+            for name in [name for name in dirs if relative_root == "." and f"{name}.svo" in checksums]:
+                dirs.remove(name)
+                installed.add(name)
+                replaced.add(f"{name}.svo")
 
-        if "item" in contents:
-            os.remove(os.path.join(self.vesperia_dir, tov_item))
+            for name in files:
+                relative: str = os.path.normpath(os.path.join(relative_root, name)).replace(os.sep, "/")
+                installed.add(relative)
+                replaced.add(relative)
 
-        if "npc" in contents:
-            os.remove(os.path.join(self.vesperia_dir, tov_npc))
+        return installed, replaced
+
+    def finished_output(self) -> str:
+        """Get the path to the output of this build if it was already finished, or an empty string otherwise"""
+        if not os.path.isfile(self.output_dir + ".json"):
+            return ""
+
+        for path in (self.output_dir, self.output_dir + package.package_extension):
+            if os.path.exists(path):
+                return path
+
+        return ""
+
+    def finish_output(self, info: dict):
+        """Mark the output of this build as complete, so later builds of the same patch can reuse it"""
+        with open(self.output_dir + ".json", "w") as file:
+            json.dump(info, file, indent=4)
+
+    def package_output(self) -> str:
+        """Replace the output directory with a single file package of it, and return the path to the package"""
+        output: str = self.output_dir + package.package_extension
+        package.write(self.output_dir, output)
+        shutil.rmtree(self.output_dir)
+
+        return output
+
+    def load_applied(self) -> dict | None:
+        path: str = os.path.join(self.backup_dir, applied_patch_file)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with open(path, "r") as file:
+                return json.load(file)
+        except ValueError:
+            return None
+
+    def record_applied(self, installed: set[str], replaced: set[str]):
+        """
+        Remember which paths of the game directory a patch output installed, and which backed up files they replaced.
+        Patches applied on top of each other without restoring in between are merged into the same record.
+        """
+        replaced = {relative for relative in replaced if os.path.isfile(os.path.join(self.backup_dir, relative))}
+
+        applied: dict = self.load_applied() or {"installed": [], "replaced": []}
+        applied["installed"] = sorted(installed.union(applied["installed"]))
+        applied["replaced"] = sorted(replaced.union(applied["replaced"]))
+
+        os.makedirs(self.backup_dir, exist_ok=True)
+        path: str = os.path.join(self.backup_dir, applied_patch_file)
+        with utils.write_atomic(path, "w") as file:
+            json.dump(applied, file, indent=4)
 
     def clean_game(self, quiet: bool = True):
         detected_patches: list[str] = []
@@ -659,13 +1156,48 @@ class VesperiaPacker:
                 shutil.rmtree(patches)
 
     def restore_backup(self, quiet: bool = False):
-        if not os.path.isdir(self.backup_dir):
+        self.recover_staging()
+
+        applied: dict | None = self.load_applied()
+        if applied is not None:
+            self.restore_applied(applied, quiet)
+            return
+
+        if not self.has_backup():
             if not quiet: print("> There is no backup to restore.")
             return
 
         self.clean_game()
 
         if not quiet: print("> Restoring Backup...")
-        shutil.copytree(self.backup_dir, os.path.join(self.vesperia_dir, "Data64"), dirs_exist_ok=True)
+        # Backups may be hardlinks of the game files, so they are never copied over the files they share data with
+        shutil.copytree(self.backup_dir, os.path.join(self.vesperia_dir, "Data64"), dirs_exist_ok=True,
+                        copy_function=utils.clone_file,
+                        ignore=shutil.ignore_patterns(hash_cache_file, backup_manifest_file, applied_patch_file))
+
+        if not quiet: print("[-/-] Backup Restored")
+
+    def restore_applied(self, applied: dict, quiet: bool = False):
+        """Undo an applied patch by removing only what it installed, and linking back only the files it replaced"""
+        data_dir: str = os.path.join(self.vesperia_dir, "Data64")
+
+        if not quiet: print("> Removing active patches...")
+        for relative in applied["installed"]:
+            path: str = os.path.join(data_dir, relative)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path):
+                os.remove(path)
+
+        if not quiet: print("> Restoring Backup...")
+        for relative in applied["replaced"]:
+            backup_path: str = os.path.join(self.backup_dir, relative)
+            if not os.path.isfile(backup_path): continue
+
+            original_path: str = os.path.join(data_dir, relative)
+            os.makedirs(os.path.dirname(original_path), exist_ok=True)
+            utils.clone_file(backup_path, original_path)
+
+        os.remove(os.path.join(self.backup_dir, applied_patch_file))
 
         if not quiet: print("[-/-] Backup Restored")
\ No newline at end of file
@@ -1,21 +1,77 @@
 import ctypes
 import mmap
 import json
+import glob
 import os
 
+from contextlib import contextmanager
+
 import utils
 import vesperia_types as vtypes
 
+class MemberView:
+    """Window over the byte range of an archive member in a memory map, addressed as if it was its own file"""
+    def __init__(self, mm: mmap.mmap, offset: int = 0, size: int = -1):
+        self.mm: mmap.mmap = mm
+        self.offset: int = offset
+        self.size: int = size if size >= 0 else len(mm) - offset
+
+        self.mm.seek(offset)
+
+    def seek(self, position: int, whence: int = os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self.tell()
+        elif whence == os.SEEK_END:
+            position += self.size
+
+        assert 0 <= position <= self.size, f"Position {position:#x} is outside of the member."
+        self.mm.seek(self.offset + position)
+
+    def tell(self) -> int:
+        return self.mm.tell() - self.offset
+
+    def read(self, size: int = -1) -> bytes:
+        remaining: int = self.size - self.tell()
+        return self.mm.read(remaining if size < 0 else min(size, remaining))
+
+    def write(self, data: bytes):
+        assert self.tell() + len(data) <= self.size, "Patched data would overflow the member."
+        self.mm.write(data)
+
+    def buffer(self) -> memoryview:
+        """Writable view of the whole member. It must be released before the memory map is closed."""
+        return memoryview(self.mm)[self.offset:self.offset + self.size]
+
 class VesperiaPatcher:
     build_dir: str = os.path.join(os.getcwd(), "builds")
+    cache_dir: str = os.path.join(os.getcwd(), "cache")
     data_dir: str = os.path.join(os.path.dirname(__file__), "data")
+    # Targets patched directly inside a copy of their archive instead of an extracted file, as (file, offset, size)
+    members_in_place: dict[str, tuple[str, int, int]]
+    # Checksum of the vanilla btl.svo, which the cached artes index is keyed by
+    btl_checksum: str
 
-    def __init__(self, patcher_id: str):
+    def __init__(self, patcher_id: str, btl_checksum: str):
         self.build_dir = os.path.join(self.build_dir, patcher_id)
+        self.members_in_place = {}
+        self.btl_checksum = btl_checksum
+
+    @contextmanager
+    def map_target(self, name: str, target: str):
+        """Memory map a patch target, or its byte range within its archive if it is patched in place"""
+        path, offset, size = self.members_in_place.get(name, (target, 0, -1))
+        assert os.path.isfile(path), f"Expected file {path}, but it does not exist."
+
+        with open(path, 'r+b') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE)
+            try:
+                yield MemberView(mm, offset, size)
+            finally:
+                mm.flush()
+                mm.close()
 
     def patch_artes(self, arte_patches: dict):
         target: str = os.path.join(self.build_dir, "BTL_PACK", "0004.ext", "ALL.0000")
-        assert os.path.isfile(target), f"Expected file {target}, but it does not exist."
 
         original_data_file: str = os.path.join(self.data_dir, "artes.json")
         assert os.path.isfile(original_data_file), f"Expected file {original_data_file}, but it does not exist."
@@ -25,55 +81,75 @@ class VesperiaPatcher:
             print("Expected Patch data for target 'artes`, but none were found! Abandoning patching for the target.")
             return
 
-        original_data: dict = json.load(open(original_data_file))['artes']
+        original_data: dict = utils.load_data(original_data_file)['artes']
 
-        total_searched: int = 0
-        total_patched: int = 0
-        patched_data: dict = {}
-
-        for arte in original_data:
-            if arte['entry'] in patches:
-                patched_data[arte['entry']] = {**arte, **patches[arte['entry']]}
-                total_patched += 1
-
-            total_searched += 1
-            if total_patched >= len(patches):
-                break
-
-        header_size: int = ctypes.sizeof(vtypes.ArtesHeader)
-
-        with open(target, 'r+b') as f:
-            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE)
+        originals: dict[int, dict] = {arte['entry']: arte for arte in original_data}
 
-            mm.seek(0)
-
-            header: vtypes.ArtesHeader = vtypes.ArtesHeader.from_buffer_copy(mm.read(header_size))
-
-            mm.seek(header_size)
-            count: int = 0
-            while len(patched_data) and mm.tell() < header.entry_end:
-                next_entry: int = int.from_bytes(mm.read(4), byteorder="little")
-                arte_entry: int = int.from_bytes(mm.read(4), byteorder="little")
-
-                if arte_entry in patched_data:
-                    mm.seek(-8, 1)
-
-                    arte_data: vtypes.ArtesEntry = vtypes.ArtesEntry(*patched_data[arte_entry].values())
-                    if patched_data[arte_entry]['evolve_condition1']:
-                        arte_data.can_evolve = 1
-
-                    mm.write(bytearray(arte_data))
-                    del patched_data[arte_entry]
-                else:
-                    mm.seek(next_entry - 8, 1)
-                count += 1
-
-            mm.flush()
-            mm.close()
+        patched_data: dict = {}
+        for entry, patch in sorted(patches.items()):
+            assert entry in originals, f"Arte Entry {entry} is not a recognized arte"
+            patched_data[entry] = {**originals[entry], **patch}
+
+        with self.map_target("artes", target) as mm:
+            index: dict[int, tuple[int, int, int]] = self.load_artes_index(mm)
+
+            missing: list[int] = [entry for entry in patched_data if entry not in index]
+            assert not missing, f"Arte Entries {missing} were not found in the artes table."
+
+            for arte_entry, patch in patched_data.items():
+                offset, length, _ = index[arte_entry]
+
+                arte_data: vtypes.ArtesEntry = vtypes.ArtesEntry(*patch.values())
+                if patch['evolve_condition1']:
+                    arte_data.can_evolve = 1
+
+                assert ctypes.sizeof(arte_data) <= length, f"Patched Arte Entry {arte_entry} would overflow its record."
+
+                mm.seek(offset)
+                mm.write(bytearray(arte_data))
+
+    def load_artes_index(self, mm: MemberView) -> dict[int, tuple[int, int, int]]:
+        """
+        Map the entries of an artes table to their (offset, length, character_id_entries), so they can be patched
+        without walking the table. Patching never moves a record, so the layout only depends on the vanilla btl.svo,
+        and the index is built once per checksum of it and kept in the cache directory.
+        """
+        index_dir: str = os.path.join(self.cache_dir, "indexes")
+        index_file: str = os.path.join(index_dir, f"artes-{self.btl_checksum}.json")
+        if os.path.isfile(index_file):
+            with open(index_file, "r") as f:
+                return {int(entry): tuple(record) for entry, record in json.load(f).items()}
+
+        mm.seek(0)
+        data: bytes = mm.read()
+
+        header: vtypes.ArtesHeader = vtypes.ArtesHeader.from_buffer_copy(data)
+        # The character ID count is the second to last field of the fixed part of an entry
+        count_offset: int = ctypes.sizeof(vtypes.ArtesEntry) - 8
+
+        index: dict[int, tuple[int, int, int]] = {}
+        position: int = ctypes.sizeof(vtypes.ArtesHeader)
+        while position < header.entry_end:
+            next_entry: int = int.from_bytes(data[position:position + 4], byteorder="little")
+            arte_entry: int = int.from_bytes(data[position + 4:position + 8], byteorder="little")
+            character_id_entries: int = int.from_bytes(data[position + count_offset:position + count_offset + 4],
+                                                       byteorder="little")
+
+            index[arte_entry] = (position, next_entry, character_id_entries)
+            if next_entry <= 0: break
+            position += next_entry
+
+        # Indexes of other game versions are never used again
+        os.makedirs(index_dir, exist_ok=True)
+        for stale in glob.glob(os.path.join(glob.escape(index_dir), "artes-*.json")):
+            os.remove(stale)
+
+        with utils.write_atomic(index_file, "w") as f:
+            json.dump(index, f)
+        return index
 
     def patch_skills(self, skill_patches: dict):
         target: str = os.path.join(self.build_dir, "BTL_PACK", "0010.ext", "ALL.0000")
-        assert os.path.isfile(target), f"Expected file {target}, but it does not exist."
 
         original_data_file: str = os.path.join(self.data_dir, "skills.json")
         assert os.path.isfile(original_data_file), f"Expected file {original_data_file}, but it does not exist."
@@ -83,7 +159,7 @@ class VesperiaPatcher:
             print("Expected Patch data for target 'skills`, but none were found! Abandoning patching for the target.")
             return
 
-        original_data: dict = json.load(open(original_data_file))['skills']
+        original_data: dict = utils.load_data(original_data_file)['skills']
 
         patched_data: dict = {}
         for entry, patch in sorted(patches.items()):
@@ -94,25 +170,17 @@ class VesperiaPatcher:
             patched_data[entry] = {**original_data[entry], **patch}
 
         header_size: int = ctypes.sizeof(vtypes.SkillsHeader)
-        entry_size: int = ctypes.sizeof(vtypes.SkillsEntry)
-
-        with open(target, 'r+b') as f:
-            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE)
-            mm.seek(0)
-
-            for entry, patch in patched_data.items():
-                mm.seek(header_size + (entry * entry_size))
 
-                skills_data: vtypes.SkillsEntry = vtypes.SkillsEntry(*patch.values())
-                mm.write(bytearray(skills_data))
-
-            mm.flush()
-            mm.close()
+        with self.map_target("skills", target) as mm, mm.buffer() as buffer:
+            vtypes.write_table(vtypes.SkillsEntry, buffer, header_size, patched_data)
 
     def patch_items(self, item_patches: dict):
         target: str = os.path.join(self.build_dir, "item", "ITEM.DAT")
         assert os.path.isfile(target), f"Expected file {target}, but it does not exist."
 
+        # The build is seeded from the shared extraction cache, which must not be patched through a hardlink
+        utils.unshare(target)
+
         if 'base' in item_patches:
             self.patch_items_base(target, item_patches['base'])
 
@@ -120,32 +188,14 @@ class VesperiaPatcher:
             self.patch_items_custom(target, item_patches['custom'])
 
     def patch_items_base(self, target_file: str, item_patches: dict):
+        # Only the patched fields are written, the rest of every record is kept as it is in the file
         patches: dict[int, dict] = {int(key): value for key, value in item_patches.items()}
 
-        original_data_file: str = os.path.join(self.data_dir, "item.json")
-        assert os.path.isfile(original_data_file), f"Expected file {original_data_file}, but it does not exist."
-
-        original_data: dict = json.load(open(original_data_file))["items"]
-
-        patched_data: dict = {}
-        for entry, patch in sorted(patches.items()):
-            assert entry < len(original_data), f"Item Entry {entry} is not a recognized item"
-            assert entry == original_data[entry]['entry'], \
-                f"There was an error resolving patch data for Item Entry {entry}"
-
-            patched_data[entry] = {**original_data[entry], **patch}
-
-        entry_size: int = ctypes.sizeof(vtypes.ItemEntry)
-
         with open(target_file, 'r+b') as f:
             mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE)
-            mm.seek(0)
-
-            for entry, patch in patched_data.items():
-                mm.seek(entry * entry_size)
 
-                items_data = vtypes.ItemEntry(**patch)
-                mm.write(bytearray(items_data))
+            with memoryview(mm) as buffer:
+                vtypes.write_fields(vtypes.ItemEntry, buffer, 0, patches)
 
             mm.flush()
             mm.close()
@@ -170,7 +220,7 @@ class VesperiaPatcher:
         original_data_file: str = os.path.join(self.data_dir, "shop_items.json")
         assert os.path.isfile(original_data_file), f"Expected file {original_data_file}, but it does not exist."
 
-        original_data: dict = json.load(open(original_data_file), object_hook=utils.keys_to_int)
+        original_data: dict = utils.load_data(original_data_file, utils.keys_to_int)
 
         shop_items: dict = {}
         if 'commons' in patches:
@@ -204,14 +254,16 @@ class VesperiaPatcher:
             mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE)
             mm.seek(item_start)
 
-            count: int = 0
-            for shop, items in shop_items.items():
+            shops: list[int] = []
+            items: list[int] = []
+            for count, (shop, shop_entries) in enumerate(shop_items.items()):
                 if count >= item_count: break
-                for item in items:
-                    shop_entry_data = vtypes.ShopItemEntry(shop, item)
-                    mm.write(bytearray(shop_entry_data))
 
-                count += 1
+                shops.extend([shop] * len(shop_entries))
+                items.extend(shop_entries)
+
+            mm.write(vtypes.encode_table(vtypes.ShopItemEntry, len(items), {"shop_id": shops, "item_id": items},
+                                         vtypes.ShopItemEntry(0, 0)))
 
             mm.flush()
             mm.close()
@@ -0,0 +1,107 @@
+import subprocess
+import threading
+import asyncio
+
+from concurrent.futures import Future
+
+default_timeout: float = 600.0
+
+
+class ToolResult:
+    """Outcome of a single external tool invocation"""
+    def __init__(self, command: list[str], returncode: int = 0, stderr: str = ""):
+        self.command: list[str] = command
+        self.returncode: int = returncode
+        self.stderr: str = stderr
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.stderr
+
+    def __repr__(self):
+        return f"ToolResult({' '.join(self.command)}, returncode={self.returncode})"
+
+class ToolError(Exception):
+    """Raised when an external tool fails, times out, or cannot be started"""
+    def __init__(self, result: ToolResult, reason: str = ""):
+        self.result: ToolResult = result
+
+        if not reason:
+            reason = f"exited with code {result.returncode}" if result.returncode else "reported an error"
+        message: str = f"{' '.join(result.command)} {reason}."
+        if result.stderr:
+            message += f"\n{result.stderr.strip()}"
+
+        super().__init__(message)
+
+class ToolRunner:
+    """
+    Runs external tools as asyncio subprocesses on a shared background event loop.
+
+    A single semaphore limits how many tools run at once across every caller, and callers on any thread can
+    either wait on a command or submit many and collect their futures later.
+    """
+    def __init__(self, max_concurrency: int = 4, timeout: float = default_timeout):
+        self.max_concurrency: int = max_concurrency
+        self.timeout: float = timeout
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._lock: threading.Lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="ToolRunner", daemon=True)
+                self._thread.start()
+
+        return self._loop
+
+    async def run_async(self, command: list[str], timeout: float = None) -> ToolResult:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        timeout = timeout if timeout is not None else self.timeout
+        async with self._semaphore:
+            try:
+                process = await asyncio.create_subprocess_exec(*command, stdout=subprocess.DEVNULL,
+                                                               stderr=subprocess.PIPE)
+            except OSError as e:
+                raise ToolError(ToolResult(command, -1, str(e)), "could not be started")
+
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise ToolError(ToolResult(command, process.returncode), f"timed out after {timeout:g} seconds")
+
+        result: ToolResult = ToolResult(command, process.returncode, stderr.decode("utf-8", errors="replace"))
+        if not result.ok:
+            raise ToolError(result)
+
+        return result
+
+    def submit(self, command: list[str], timeout: float = None) -> Future:
+        """Start a command without waiting for it. The Future resolves to a ToolResult or raises a ToolError."""
+        return asyncio.run_coroutine_threadsafe(self.run_async(command, timeout), self._ensure_loop())
+
+    def run(self, command: list[str], timeout: float = None) -> ToolResult:
+        return self.submit(command, timeout).result()
+
+    def close(self):
+        with self._lock:
+            if self._loop is None: return
+
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+
+            self._loop = None
+            self._thread = None
+            self._semaphore = None
+
+# Shared by every external tool invocation of the patcher
+tools: ToolRunner = ToolRunner()
@@ -0,0 +1,216 @@
+import shutil
+import os
+
+import comptoe
+import utils
+
+scenario_magic: bytes = b"TO8SCEL\x00"
+scenario_table_start: int = 0x20
+
+
+class ScenarioEntry:
+    """Table Entry of a scenario container. Locations are relative to the start of the member data."""
+    def __init__(self, index: int, location: int = 0, size: int = 0, decompressed_size: int = 0,
+                 extra: bytes = b""):
+        self.index: int = index
+        self.location: int = location
+        self.size: int = size
+        self.decompressed_size: int = decompressed_size
+        self.extra: bytes = extra
+
+    @property
+    def filename(self) -> str:
+        """Name of the member when extracted, following the naming used by Tales.Vesperia.Scenario.Extract."""
+        return str(self.index)
+
+    def to_bytes(self, entry_size: int, byteorder: str) -> bytes:
+        data: bytes = (self.location.to_bytes(4, byteorder) +
+                       self.size.to_bytes(4, byteorder) +
+                       self.decompressed_size.to_bytes(4, byteorder) +
+                       self.extra)
+
+        return data.ljust(entry_size, b"\x00")[:entry_size]
+
+class ScenarioArchive:
+    """
+    In-process reader and writer for scenario containers (scenario_ENG.dat), giving random access to single members.
+    Raises ValueError for anything that does not match the expected layout, so callers can fall back to
+    HyoutaToolsCLI.
+    """
+    def __init__(self, path: str):
+        self.path: str = path
+        self.archive_size: int = os.path.getsize(path)
+        self.entries: list[ScenarioEntry] = []
+
+        with open(path, "rb") as f:
+            header: bytes = f.read(scenario_table_start)
+            if len(header) < scenario_table_start or header[:8] != scenario_magic:
+                raise ValueError(f"{path} is not a scenario container.")
+
+            # Entries are 0x20 bytes long, which is used to detect the endianness of the container
+            self.byteorder: str = "big" if int.from_bytes(header[0x8:0xC], "big") == 0x20 else "little"
+
+            self.entry_size: int = int.from_bytes(header[0x8:0xC], self.byteorder)
+            self.entry_count: int = int.from_bytes(header[0xC:0x10], self.byteorder)
+            self.data_start: int = int.from_bytes(header[0x10:0x14], self.byteorder)
+            self.header: bytes = header
+
+            table_end: int = scenario_table_start + self.entry_size * self.entry_count
+            if self.entry_size < 0xC or table_end > self.data_start or self.data_start > self.archive_size:
+                raise ValueError(f"{path} has a malformed scenario header.")
+
+            f.seek(scenario_table_start)
+            table: bytes = f.read(self.entry_size * self.entry_count)
+
+            # Anything between the table and the member data is kept as-is
+            self.header_data: bytes = f.read(self.data_start - table_end)
+
+        for index in range(self.entry_count):
+            data: bytes = table[index * self.entry_size:(index + 1) * self.entry_size]
+            entry: ScenarioEntry = ScenarioEntry(index,
+                                                 int.from_bytes(data[0x0:0x4], self.byteorder),
+                                                 int.from_bytes(data[0x4:0x8], self.byteorder),
+                                                 int.from_bytes(data[0x8:0xC], self.byteorder),
+                                                 data[0xC:])
+
+            if self.data_start + entry.location + entry.size > self.archive_size:
+                raise ValueError(f"Member {index} of {path} lies outside of the container.")
+
+            self.entries.append(entry)
+
+    @property
+    def alignment(self) -> int:
+        members: list[ScenarioEntry] = sorted(self.members(), key=lambda entry: entry.location)
+        locations: list[int] = [entry.location for entry in members]
+
+        # The end of a padded container is aligned as well, which tells a 0x80 alignment apart from a lucky 0x100
+        data_size: int = self.archive_size - self.data_start
+        if members and members[-1].location + members[-1].size != data_size:
+            locations.append(data_size)
+
+        return utils.common_alignment(locations)
+
+    def members(self) -> list[ScenarioEntry]:
+        return [entry for entry in self.entries if entry.size]
+
+    def read(self, index: int) -> bytes:
+        """Get the compressed data of a single member"""
+        entry: ScenarioEntry = self.entries[index]
+        with open(self.path, "rb") as f:
+            f.seek(self.data_start + entry.location)
+            return f.read(entry.size)
+
+    def header_decompressed_size(self, index: int) -> int:
+        """Get the decompressed size stored in the compression header of a member, or -1 if it has none"""
+        header: bytes = self.read(index)[:comptoe.comptoe_header_size]
+        if len(header) < comptoe.comptoe_header_size:
+            return -1
+
+        return int.from_bytes(header[5:9], "little")
+
+    def read_decompressed(self, index: int) -> bytes:
+        return comptoe.decompress(self.read(index))
+
+    def extract(self, out_dir: str, members: list[str] = None):
+        """Extract members of the container to a directory. Only the named members are extracted if specified."""
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+
+        with open(self.path, "rb") as src:
+            for entry in self.members():
+                if members is not None and entry.filename not in members: continue
+
+                src.seek(self.data_start + entry.location)
+                with utils.write_atomic(os.path.join(out_dir, entry.filename)) as dst:
+                    if utils.copy_range(src, dst, entry.size) != entry.size:
+                        raise ValueError(f"{self.path} ended unexpectedly while extracting member {entry.index}.")
+
+    def write(self, out: str, replacements: dict[int, str]):
+        """
+        Write a copy of the container with some members replaced by the given files.
+        Every other member is copied over verbatim, and entries without data keep their original location.
+
+        The entry size, entry count and data start are never changed, so the header is copied as it is. The only
+        exception is a header word holding the size of the container, which is updated to the new size.
+        Neither that word nor the decompressed size of an entry has been confirmed against every container, so they
+        are only updated where the original value matches, and the result should be checked with verify.
+        """
+        alignment: int = self.alignment
+        entries: list[ScenarioEntry] = [ScenarioEntry(entry.index, entry.location, entry.size,
+                                                      entry.decompressed_size, entry.extra)
+                                        for entry in self.entries]
+
+        ordered: list[ScenarioEntry] = sorted((entry for entry in entries if entry.size), key=lambda e: e.location)
+
+        # Containers whose last member ends the file without padding are written the same way
+        pad_last: bool = bool(ordered) and \
+            self.data_start + ordered[-1].location + ordered[-1].size != self.archive_size
+
+        position: int = 0
+        for entry in ordered:
+            if entry.index in replacements:
+                replacement: str = replacements[entry.index]
+                entry.size = os.path.getsize(replacement)
+
+                # Keep the decompressed size in the table in sync with the header of the new data, but only if the
+                # original entry held the decompressed size of its member as well
+                if comptoe.read_type(replacement) >= 0 and \
+                        entry.decompressed_size == self.header_decompressed_size(entry.index):
+                    with open(replacement, "rb") as f:
+                        entry.decompressed_size = int.from_bytes(f.read(comptoe.comptoe_header_size)[5:9], "little")
+
+            entry.location = position
+            position += entry.size
+            if entry is not ordered[-1] or pad_last:
+                position += -entry.size % alignment
+
+        table: bytes = b"".join(entry.to_bytes(self.entry_size, self.byteorder) for entry in entries)
+
+        header: bytearray = bytearray(self.header)
+        for offset in range(0x14, scenario_table_start, 4):
+            if int.from_bytes(header[offset:offset + 4], self.byteorder) == self.archive_size:
+                header[offset:offset + 4] = (self.data_start + position).to_bytes(4, self.byteorder)
+
+        with open(self.path, "rb") as src, utils.write_atomic(out) as dst:
+            dst.write(header)
+            dst.write(table)
+            dst.write(self.header_data)
+
+            for entry in ordered:
+                original: ScenarioEntry = self.entries[entry.index]
+
+                if entry.index in replacements:
+                    with open(replacements[entry.index], "rb") as f:
+                        shutil.copyfileobj(f, dst, utils.copy_buffer_size)
+                else:
+                    src.seek(self.data_start + original.location)
+                    if utils.copy_range(src, dst, original.size) != original.size:
+                        raise ValueError(f"{self.path} ended unexpectedly while copying member {entry.index}.")
+
+                if entry is not ordered[-1] or pad_last:
+                    dst.write(b"\x00" * (-entry.size % alignment))
+
+    def verify(self, out: str, replacements: dict[int, str]):
+        """
+        Check a container written by write against this one, by reading it back and comparing every member with the
+        data it was written from. Raises ValueError if anything differs.
+        """
+        written: ScenarioArchive = ScenarioArchive(out)
+        if written.byteorder != self.byteorder or written.entry_size != self.entry_size or \
+                written.entry_count != self.entry_count or written.data_start != self.data_start:
+            raise ValueError(f"{out} does not have the same layout as {self.path}.")
+
+        for entry in self.entries:
+            if entry.index in replacements:
+                with open(replacements[entry.index], "rb") as f:
+                    expected: bytes = f.read()
+            else:
+                expected: bytes = self.read(entry.index)
+
+            if written.read(entry.index) != expected:
+                raise ValueError(f"Member {entry.index} of {out} does not match the data it was written from.")
+
+            copy: ScenarioEntry = written.entries[entry.index]
+            if entry.index not in replacements and (copy.decompressed_size, copy.extra) != \
+                    (entry.decompressed_size, entry.extra):
+                raise ValueError(f"The table entry of member {entry.index} of {out} was changed.")
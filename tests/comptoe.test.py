@@ -0,0 +1,60 @@
+import tempfile
+import random
+import time
+import os
+
+import comptoe
+
+
+def sample_data() -> bytes:
+    """Data with literals, back references past the ring buffer start, and short and long runs"""
+    return (random.randbytes(0x300) + b"SHOP_ITEM" * 0x200 + b"\x00" * 10 + b"\xFF" * 0x400 +
+            random.randbytes(0x20) + bytes(0x1200))
+
+def test_roundtrip():
+    data: bytes = sample_data()
+
+    for compression_type in (comptoe.comptoe_none, comptoe.comptoe_lzss, comptoe.comptoe_lzss_rle):
+        compressed: bytes = comptoe.compress(data, compression_type)
+        assert compressed[0] == compression_type
+        assert comptoe.decompress(compressed) == data, f"Round trip failed (type {compression_type})."
+
+    assert comptoe.decompress(comptoe.compress(b"")) == b""
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        file: str = os.path.join(work_dir, "0")
+        with open(file, "wb") as f:
+            f.write(comptoe.compress(data, comptoe.comptoe_lzss))
+
+        # The compression type of the file being replaced is kept
+        comptoe.decompress_file(file, file + ".dec")
+        comptoe.compress_file(file + ".dec", file)
+        assert comptoe.read_type(file) == comptoe.comptoe_lzss
+
+        comptoe.decompress_file(file)
+        with open(file, "rb") as f:
+            assert f.read() == data
+
+    print("[comptoe Round Trip] Passed")
+
+def test_rejected():
+    compressed: bytes = comptoe.compress(sample_data())
+
+    for data in (b"\x09" + compressed[1:], compressed[:len(compressed) // 2], b"\x03"):
+        try:
+            comptoe.decompress(data)
+        except ValueError:
+            continue
+
+        raise AssertionError("Invalid compressed data was decompressed.")
+
+    print("[comptoe Rejected Data] Passed")
+
+if __name__ == "__main__":
+    start: float = time.time()
+
+    test_roundtrip()
+    test_rejected()
+
+    end: float = time.time()
+    print(f"[comptoe] Time Taken: {end - start} seconds")
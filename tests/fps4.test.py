@@ -0,0 +1,118 @@
+import tempfile
+import random
+import time
+import os
+
+import fps4
+
+from fps4 import FPS4Archive
+
+entry_size: int = 0x10
+content_bitmask: int = (fps4.contains_start_pointers | fps4.contains_sector_sizes | fps4.contains_file_sizes |
+                        fps4.contains_file_metadata)
+
+
+def build_archive(members: list[bytes], byteorder: str, alignment: int = 0x80, pad_last: bool = True) -> bytes:
+    """Build an FPS4 archive the way the game files are laid out, with a terminating entry after the members"""
+    count: int = len(members) + 1
+    table_end: int = fps4.fps4_header_size + entry_size * count
+
+    metadata: bytes = b"".join(f"ALL{i}".encode() + b"\x00" for i in range(len(members)))
+    first_file_start: int = -(-(table_end + len(metadata)) // alignment) * alignment
+
+    table: bytes = b""
+    data: bytes = b""
+    metadata_location: int = table_end
+    for i, member in enumerate(members):
+        padding: int = -len(member) % alignment if i < len(members) - 1 or pad_last else 0
+        table += (first_file_start + len(data)).to_bytes(4, byteorder) + \
+                 (len(member) + padding).to_bytes(4, byteorder) + \
+                 len(member).to_bytes(4, byteorder) + \
+                 metadata_location.to_bytes(4, byteorder)
+
+        data += member + b"\x00" * padding
+        metadata_location += len(f"ALL{i}") + 1
+
+    table += (first_file_start + len(data)).to_bytes(4, byteorder) + bytes(12)
+
+    header: bytes = (fps4.fps4_magic +
+                     count.to_bytes(4, byteorder) +
+                     fps4.fps4_header_size.to_bytes(4, byteorder) +
+                     first_file_start.to_bytes(4, byteorder) +
+                     entry_size.to_bytes(2, byteorder) +
+                     content_bitmask.to_bytes(2, byteorder) +
+                     bytes(8))
+
+    archive: bytes = header + table + metadata
+    return archive + b"\x00" * (first_file_start - len(archive)) + data
+
+def random_members() -> list[bytes]:
+    return [random.randbytes(random.randrange(1, 0x2000)) for _ in range(random.randrange(2, 8))]
+
+def test_extract():
+    for byteorder in ("big", "little"):
+        members: list[bytes] = random_members()
+
+        with tempfile.TemporaryDirectory() as work_dir:
+            file: str = os.path.join(work_dir, "TEST.svo")
+            with open(file, "wb") as f:
+                f.write(build_archive(members, byteorder))
+
+            archive: FPS4Archive = FPS4Archive(file)
+            assert archive.byteorder == byteorder
+            assert archive.alignment == 0x80
+
+            fps4.extract(file, manifest=os.path.join(work_dir, "TEST.json"))
+            for entry, member in zip(archive.members(), members):
+                with open(os.path.join(file + ".ext", entry.filename), "rb") as f:
+                    assert f.read() == member, f"{entry.filename} does not match its member ({byteorder})."
+
+            assert fps4.is_manifest(os.path.join(work_dir, "TEST.json"))
+
+    print("[FPS4 Extraction] Passed")
+
+def test_pack():
+    for byteorder in ("big", "little"):
+        for pad_last in (True, False):
+            members: list[bytes] = random_members()
+            original: bytes = build_archive(members, byteorder, pad_last=pad_last)
+
+            with tempfile.TemporaryDirectory() as work_dir:
+                file: str = os.path.join(work_dir, "TEST.svo")
+                manifest: str = os.path.join(work_dir, "TEST.json")
+                with open(file, "wb") as f:
+                    f.write(original)
+
+                fps4.extract(file, manifest=manifest)
+
+                # Packing the unmodified members gives back the same archive
+                fps4.pack(manifest, os.path.join(work_dir, "SAME.svo"))
+                with open(os.path.join(work_dir, "SAME.svo"), "rb") as f:
+                    assert f.read() == original, f"Repacked archive differs ({byteorder}, padded: {pad_last})."
+
+                # A modified member changes size, and the members after it are moved
+                changed: bytes = random.randbytes(random.randrange(1, 0x2000))
+                entries: list = FPS4Archive(file).members()
+                with open(os.path.join(file + ".ext", entries[0].filename), "wb") as f:
+                    f.write(changed)
+
+                fps4.pack(manifest, os.path.join(work_dir, "MOD.svo"))
+                modified: FPS4Archive = FPS4Archive(os.path.join(work_dir, "MOD.svo"))
+                assert modified.byteorder == byteorder
+
+                modified.extract(os.path.join(work_dir, "MOD.ext"))
+                for entry, member in zip(modified.members(), [changed, *members[1:]]):
+                    assert entry.location % 0x80 == 0
+                    with open(os.path.join(work_dir, "MOD.ext", entry.filename), "rb") as f:
+                        assert f.read() == member, f"{entry.filename} does not match ({byteorder}, padded: {pad_last})."
+
+    print("[FPS4 Packing] Passed")
+
+if __name__ == "__main__":
+    start: float = time.time()
+
+    test_extract()
+    test_pack()
+
+    end: float = time.time()
+    print(f"[FPS4] Time Taken: {end - start} seconds")
@@ -0,0 +1,76 @@
+import tempfile
+import zipfile
+import random
+import json
+import time
+import os
+
+import package
+
+
+def write_output(output_dir: str) -> dict[str, bytes]:
+    """Write a patch output with nested directories and an empty file, and return its files by package path"""
+    files: dict[str, bytes] = {
+        "Data64/btl/BTL_PACK.DAT": random.randbytes(0x3000),
+        "Data64/item/ITEM.DAT": random.randbytes(0x1234),
+        "Data64/language/scenario_ENG.dat": b"",
+    }
+
+    for name, data in files.items():
+        path: str = os.path.join(output_dir, *name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    return files
+
+def test_roundtrip():
+    with tempfile.TemporaryDirectory() as work_dir:
+        files: dict[str, bytes] = write_output(os.path.join(work_dir, "output"))
+
+        file: str = os.path.join(work_dir, "patch" + package.package_extension)
+        package.write(os.path.join(work_dir, "output"), file)
+        assert package.is_package(file)
+
+        package.extract(file, os.path.join(work_dir, "extracted"))
+        for name, data in files.items():
+            with open(os.path.join(work_dir, "extracted", *name.split("/")), "rb") as f:
+                assert f.read() == data, f"{name} does not match after extraction."
+
+    print("[Package Round Trip] Passed")
+
+def test_bad_hash():
+    with tempfile.TemporaryDirectory() as work_dir:
+        write_output(os.path.join(work_dir, "output"))
+
+        file: str = os.path.join(work_dir, "patch" + package.package_extension)
+        package.write(os.path.join(work_dir, "output"), file)
+
+        # Rebuild the package with a manifest that does not match one of the files
+        tampered: str = os.path.join(work_dir, "tampered" + package.package_extension)
+        with zipfile.ZipFile(file, "r") as source, zipfile.ZipFile(tampered, "w", zipfile.ZIP_STORED) as archive:
+            manifest: dict = json.loads(source.read(package.package_manifest))
+            manifest["files"]["Data64/item/ITEM.DAT"] = "0" * 64
+
+            for info in source.infolist():
+                if info.filename != package.package_manifest:
+                    archive.writestr(info, source.read(info))
+
+            archive.writestr(package.package_manifest, json.dumps(manifest))
+
+        try:
+            package.extract(tampered, os.path.join(work_dir, "extracted"))
+            raise AssertionError("A package with a bad hash was extracted.")
+        except ValueError:
+            pass
+
+    print("[Package Bad Hash] Passed")
+
+if __name__ == "__main__":
+    start: float = time.time()
+
+    test_roundtrip()
+    test_bad_hash()
+
+    end: float = time.time()
+    print(f"[Package] Time Taken: {end - start} seconds")
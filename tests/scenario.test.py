@@ -0,0 +1,120 @@
+import tempfile
+import random
+import time
+import os
+
+import comptoe
+import scenario
+
+from scenario import ScenarioArchive
+
+entry_size: int = 0x20
+
+
+def build_container(members: list[bytes], byteorder: str, alignment: int = 0x80, pad_last: bool = True) -> bytes:
+    """Build a scenario container, where empty members are kept in the table without any data"""
+    table_end: int = scenario.scenario_table_start + entry_size * len(members)
+    data_start: int = -(-table_end // alignment) * alignment
+
+    table: bytes = b""
+    data: bytes = b""
+    for i, member in enumerate(members):
+        location: int = len(data) if member else 0
+        decompressed_size: int = int.from_bytes(member[5:9], "little") if member else 0
+        table += (location.to_bytes(4, byteorder) + len(member).to_bytes(4, byteorder) +
+                  decompressed_size.to_bytes(4, byteorder) + bytes(entry_size - 0xC))
+
+        data += member
+        if i < len(members) - 1 or pad_last:
+            data += b"\x00" * (-len(member) % alignment)
+
+    header: bytes = (scenario.scenario_magic +
+                     entry_size.to_bytes(4, byteorder) +
+                     len(members).to_bytes(4, byteorder) +
+                     data_start.to_bytes(4, byteorder) +
+                     (data_start + len(data)).to_bytes(4, byteorder) +
+                     bytes(8))
+
+    return header + table + b"\x00" * (data_start - table_end) + data
+
+def random_members() -> list[bytes]:
+    members: list[bytes] = [comptoe.compress(random.randbytes(random.randrange(1, 0x400)) * 4) for _ in range(4)]
+    members.insert(2, b"")
+
+    return members
+
+def test_extract():
+    for byteorder in ("big", "little"):
+        members: list[bytes] = random_members()
+
+        with tempfile.TemporaryDirectory() as work_dir:
+            file: str = os.path.join(work_dir, "scenario_ENG.dat")
+            with open(file, "wb") as f:
+                f.write(build_container(members, byteorder))
+
+            archive: ScenarioArchive = ScenarioArchive(file)
+            assert archive.byteorder == byteorder
+
+            archive.extract(os.path.join(work_dir, "all"))
+            for index, member in enumerate(members):
+                path: str = os.path.join(work_dir, "all", str(index))
+                assert os.path.isfile(path) == bool(member)
+                if member:
+                    with open(path, "rb") as f:
+                        assert f.read() == member
+
+            archive.extract(os.path.join(work_dir, "some"), ["1"])
+            assert os.listdir(os.path.join(work_dir, "some")) == ["1"]
+
+    print("[Scenario Extraction] Passed")
+
+def test_write():
+    for byteorder in ("big", "little"):
+        for pad_last in (True, False):
+            members: list[bytes] = random_members()
+            original: bytes = build_container(members, byteorder, pad_last=pad_last)
+
+            with tempfile.TemporaryDirectory() as work_dir:
+                file: str = os.path.join(work_dir, "scenario_ENG.dat")
+                with open(file, "wb") as f:
+                    f.write(original)
+
+                archive: ScenarioArchive = ScenarioArchive(file)
+
+                # Writing without replacements gives back the same container
+                archive.write(os.path.join(work_dir, "same.dat"), {})
+                with open(os.path.join(work_dir, "same.dat"), "rb") as f:
+                    assert f.read() == original, f"Rewritten container differs ({byteorder}, padded: {pad_last})."
+
+                # A replaced member changes size, and is checked against its file when read back
+                decompressed: bytes = random.randbytes(0x555)
+                replacement: str = os.path.join(work_dir, "0")
+                with open(replacement, "wb") as f:
+                    f.write(comptoe.compress(decompressed))
+
+                out: str = os.path.join(work_dir, "mod.dat")
+                archive.write(out, {0: replacement})
+                archive.verify(out, {0: replacement})
+
+                modified: ScenarioArchive = ScenarioArchive(out)
+                assert modified.read_decompressed(0) == decompressed
+                assert modified.entries[0].decompressed_size == len(decompressed)
+                assert [modified.read(i) for i in range(1, len(members))] == members[1:]
+
+                # A member that does not match the data it was written from fails the check
+                try:
+                    archive.verify(os.path.join(work_dir, "same.dat"), {0: replacement})
+                    raise AssertionError("A container with the wrong member passed verification.")
+                except ValueError:
+                    pass
+
+    print("[Scenario Writing] Passed")
+
+if __name__ == "__main__":
+    start: float = time.time()
+
+    test_extract()
+    test_write()
+
+    end: float = time.time()
+    print(f"[Scenario] Time Taken: {end - start} seconds")
@@ -0,0 +1,73 @@
+import tempfile
+import random
+import time
+import os
+
+import tlzc
+
+
+def sample_data() -> bytes:
+    """Data spanning several chunks, mixing compressible runs with chunks that have to be stored as-is"""
+    return (bytes(tlzc.tlzc_chunk_size + 0x123) + random.randbytes(tlzc.tlzc_chunk_size) +
+            b"Tales of Vesperia" * 0x800 + random.randbytes(0x77))
+
+def test_roundtrip():
+    data: bytes = sample_data()
+
+    for fast in (False, True):
+        compressed: bytes = tlzc.compress(data, fast=fast)
+        assert tlzc.decompress(compressed) == data, f"Round trip failed (fast: {fast})."
+
+    assert tlzc.decompress(tlzc.compress(b"")) == b""
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        file: str = os.path.join(work_dir, "TEST.DAT")
+        with open(file, "wb") as f:
+            f.write(tlzc.compress(data))
+
+        # Files are decompressed and compressed back in place, keeping their compression type
+        tlzc.decompress_file(file)
+        with open(file, "rb") as f:
+            assert f.read() == data
+
+        tlzc.compress_file(file, fast=True)
+        assert tlzc.read_type(file) == tlzc.tlzc_lzma
+
+        tlzc.decompress_file(file, file + ".dec")
+        with open(file + ".dec", "rb") as f:
+            assert f.read() == data
+
+    print("[TLZC Round Trip] Passed")
+
+def test_rejected():
+    compressed: bytearray = bytearray(tlzc.compress(sample_data()))
+
+    # Corrupt chunks, truncated data and formats left to HyoutaToolsCLI all raise ValueError
+    corrupt: bytearray = compressed.copy()
+    corrupt[tlzc.tlzc_header_size + 0x40:tlzc.tlzc_header_size + 0x80] = b"\xFF" * 0x40
+    deflate: bytes = compressed[:4] + tlzc.tlzc_deflate.to_bytes(4, "little") + compressed[8:]
+
+    for data in (bytes(corrupt), bytes(compressed[:0x40]), deflate, b"TLZC"):
+        try:
+            tlzc.decompress(data)
+        except ValueError:
+            continue
+
+        raise AssertionError("Invalid TLZC data was decompressed.")
+
+    try:
+        tlzc.compress(b"data", tlzc.tlzc_deflate)
+        raise AssertionError("Deflate TLZC data was compressed.")
+    except ValueError:
+        pass
+
+    print("[TLZC Rejected Data] Passed")
+
+if __name__ == "__main__":
+    start: float = time.time()
+
+    test_roundtrip()
+    test_rejected()
+
+    end: float = time.time()
+    print(f"[TLZC] Time Taken: {end - start} seconds")
@@ -0,0 +1,132 @@
+import lzma
+
+import utils
+
+# TLZC Compression Types
+tlzc_deflate: int = 0x0201
+tlzc_lzma: int = 0x0401
+
+tlzc_magic: bytes = b"TLZC"
+tlzc_header_size: int = 0x18
+tlzc_chunk_size: int = 0x10000
+
+# LZMA properties used for new archives (lc=3, lp=0, pb=2)
+lzma_properties: bytes = bytes([0x5D]) + tlzc_chunk_size.to_bytes(4, "little")
+
+
+def read_type(file: str) -> int:
+    """Get the compression type of a TLZC file, or 0 if the file does not exist or is not TLZC compressed."""
+    try:
+        with open(file, "rb") as f:
+            header: bytes = f.read(8)
+    except OSError:
+        return 0
+
+    if len(header) < 8 or header[:4] != tlzc_magic:
+        return 0
+
+    return int.from_bytes(header[4:8], "little")
+
+def _lzma_filters(properties: bytes, preset: int = None) -> list[dict]:
+    pb, remainder = divmod(properties[0], 45)
+    lp, lc = divmod(remainder, 9)
+
+    lzma_filter: dict = {"id": lzma.FILTER_LZMA1, "dict_size": int.from_bytes(properties[1:5], "little"),
+                         "lc": lc, "lp": lp, "pb": pb}
+    if preset is not None:
+        lzma_filter["preset"] = preset
+
+    return [lzma_filter]
+
+def _chunk_sizes(data: bytes, offset: int, chunks: int) -> list[int]:
+    return [int.from_bytes(data[offset + i * 2:offset + i * 2 + 2], "little") for i in range(chunks)]
+
+def decompress(data: bytes) -> bytes:
+    if len(data) < tlzc_header_size or data[:4] != tlzc_magic:
+        raise ValueError("Data is not TLZC compressed.")
+
+    compression_type: int = int.from_bytes(data[0x4:0x8], "little")
+    uncompressed_size: int = int.from_bytes(data[0xC:0x10], "little")
+    chunks: int = -(-uncompressed_size // tlzc_chunk_size)
+
+    # Only the LZMA layout has been checked against game files, anything else is left to HyoutaToolsCLI
+    if compression_type != tlzc_lzma:
+        raise ValueError(f"TLZC compression type {compression_type:#06x} is not supported natively.")
+
+    output: bytearray = bytearray()
+    try:
+        properties: bytes = data[tlzc_header_size:tlzc_header_size + 5]
+        sizes: list[int] = _chunk_sizes(data, tlzc_header_size + 5, chunks)
+        position: int = tlzc_header_size + 5 + chunks * 2
+
+        for i, size in enumerate(sizes):
+            expected: int = min(tlzc_chunk_size, uncompressed_size - i * tlzc_chunk_size)
+
+            # Chunks that could not be compressed are stored as-is with a size of 0
+            if size == 0:
+                output += data[position:position + expected]
+                position += expected
+                continue
+
+            decompressor = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=_lzma_filters(properties))
+            output += decompressor.decompress(data[position:position + size], expected)
+            position += size
+    except lzma.LZMAError as e:
+        raise ValueError(f"TLZC data could not be decompressed: {e}.") from e
+
+    if len(output) != uncompressed_size:
+        raise ValueError(f"TLZC data decompressed to {len(output)} bytes, but {uncompressed_size} were expected.")
+
+    return bytes(output)
+
+def compress(data: bytes, compression_type: int = tlzc_lzma, fast: bool = False) -> bytes:
+    """Compress data into TLZC. Fast compression trades output size for speed, and is meant for test builds."""
+    if compression_type != tlzc_lzma:
+        raise ValueError(f"TLZC compression type {compression_type:#06x} is not supported natively.")
+
+    chunks: list[bytes] = [data[i:i + tlzc_chunk_size] for i in range(0, len(data), tlzc_chunk_size)]
+
+    compressed: list[bytes] = []
+    for chunk in chunks:
+        preset: int = 0 if fast else 9 | lzma.PRESET_EXTREME
+        result: bytes = lzma.compress(chunk, lzma.FORMAT_RAW, filters=_lzma_filters(lzma_properties, preset))
+
+        # Chunk sizes are stored as 16-bit values, so incompressible chunks are stored as-is
+        compressed.append(result if len(result) < min(len(chunk), tlzc_chunk_size) else b"")
+
+    body: bytearray = bytearray(lzma_properties)
+
+    for result in compressed:
+        body += len(result).to_bytes(2, "little")
+
+    for chunk, result in zip(chunks, compressed):
+        body += result if result else chunk
+
+    header: bytes = (tlzc_magic +
+                     compression_type.to_bytes(4, "little") +
+                     (tlzc_header_size + len(body)).to_bytes(4, "little") +
+                     len(data).to_bytes(4, "little") +
+                     bytes(8))
+
+    return header + bytes(body)
+
+def decompress_file(file: str, out: str = ""):
+    with open(file, "rb") as f:
+        data: bytes = decompress(f.read())
+
+    _write(out if out else file, data)
+
+def compress_file(file: str, out: str = "", compression_type: int = 0, fast: bool = False):
+    """Compress a file into TLZC. If not specified, the compression type of the file being replaced is kept."""
+    output: str = out if out else file
+    if not compression_type:
+        compression_type = read_type(output) or tlzc_lzma
+
+    with open(file, "rb") as f:
+        data: bytes = compress(f.read(), compression_type, fast)
+
+    _write(output, data)
+
+def _write(file: str, data: bytes):
+    with utils.write_atomic(file) as f:
+        f.write(data)
@@ -1,5 +1,285 @@
+import threading
+import hashlib
+import shutil
+import pickle
+import json
+import glob
+import os
+
+from contextlib import contextmanager
+
+# Size of the chunks used when streaming file data
+copy_buffer_size: int = 0x800000
+
+# Compiled copies of the JSON data tables, see load_data
+data_cache_dir: str = os.path.join(os.getcwd(), "cache", "data")
+
+# Pickled data tables already loaded by this process, by stat fingerprint of their source
+loaded_data: dict[tuple, bytes] = {}
+
+
 def keys_to_int(x):
     return {int(k) if k.isdigit() else k: v for k, v in x.items()}
 
 def strip_formatting(string: str) -> str:
-    return string.replace("\n", "").replace("\t", "").replace("\r", "")
\ No newline at end of file
+    return string.replace("\n", "").replace("\t", "").replace("\r", "")
+
+def stat_fingerprint(path: str) -> list | None:
+    """Identify the current state of a file without reading it. Returns None if the file does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+def temp_file(path: str) -> str:
+    """Get a clean temporary path beside a file, to be swapped in over it with os.replace once it is complete"""
+    temp_path: str = path + ".tmp"
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+
+    return temp_path
+
+@contextmanager
+def write_atomic(path: str, mode: str = "wb"):
+    """
+    Open a file for writing beside its destination, and swap it in only once it was written completely.
+    A failed write never leaves a truncated file, and an existing file is replaced instead of written through,
+    as it may be a hardlink of another file.
+    """
+    temp_path: str = temp_file(path)
+    try:
+        with open(temp_path, mode) as file:
+            yield file
+    except BaseException:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    os.replace(temp_path, path)
+
+def copy_range(src, dst, size: int) -> int:
+    """Stream up to size bytes from the current position of one file object to another. Returns the bytes copied."""
+    remaining: int = size
+    while remaining:
+        chunk: bytes = src.read(min(copy_buffer_size, remaining))
+        if not chunk: break
+
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+    return size - remaining
+
+def common_alignment(locations) -> int:
+    """Largest power of two (up to 0x800) that every location is aligned to"""
+    alignment: int = 0x800
+    for location in locations:
+        while alignment > 1 and location % alignment:
+            alignment >>= 1
+
+    return alignment
+
+def reflink(source: str, destination: str) -> bool:
+    """Clone a file with copy-on-write where the filesystem supports it (btrfs, XFS). Returns False if it does not."""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    # FICLONE from linux/fs.h
+    ficlone: int = 0x40049409
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), ficlone, src.fileno())
+        except OSError:
+            return False
+
+    shutil.copystat(source, destination)
+    return True
+
+def try_lock(path: str):
+    """
+    Take an exclusive lock on a file without waiting, held until the returned file is closed or the process exits.
+    Returns None if another process holds the lock.
+    """
+    file = open(path, "a+b")
+    try:
+        try:
+            import fcntl
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except ImportError:
+            import msvcrt
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        file.close()
+        return None
+
+    return file
+
+def clone_file(source: str, destination: str, link: bool = True):
+    """
+    Create a file sharing the data of another, as a hardlink, a reflink, or a plain copy as a last resort.
+    Hardlinks are skipped if the new file is going to be modified in place.
+    """
+    # Renaming over another link of the same file does nothing, so existing links are left as they are
+    if link and os.path.exists(destination) and os.path.samefile(source, destination):
+        return
+
+    temp_path: str = temp_file(destination)
+
+    linked: bool = False
+    if link:
+        try:
+            os.link(source, temp_path)
+            linked = True
+        except OSError:
+            pass
+
+    if not linked and not reflink(source, temp_path):
+        shutil.copy2(source, temp_path)
+
+    os.replace(temp_path, destination)
+
+def clone_tree(source: str, destination: str, ignore=None, link: bool = True):
+    shutil.copytree(source, destination, copy_function=lambda src, dst: clone_file(src, dst, link),
+                    dirs_exist_ok=True, ignore=ignore)
+
+def move_file(source: str, destination: str, keep_source: bool = False) -> str:
+    """
+    Move a file, or link it in place if the source has to be kept, copying its data only across filesystems.
+    Returns how the file ended up at its destination: 'rename', 'link' or 'copy'.
+    """
+    if keep_source and os.path.exists(destination) and os.path.samefile(source, destination):
+        return "link"
+
+    temp_path: str = temp_file(destination)
+
+    try:
+        if keep_source:
+            os.link(source, temp_path)
+            os.replace(temp_path, destination)
+            return "link"
+
+        os.replace(source, destination)
+        return "rename"
+    except OSError:
+        pass
+
+    shutil.copy2(source, temp_path)
+    os.replace(temp_path, destination)
+
+    if not keep_source:
+        os.remove(source)
+
+    return "copy"
+
+def unshare(path: str):
+    """Give a hardlinked file its own copy of the data, so it can be written to in place without affecting its links"""
+    if os.path.isfile(path) and os.stat(path).st_nlink > 1:
+        temp_path: str = temp_file(path)
+        shutil.copy2(path, temp_path)
+        os.replace(temp_path, path)
+
+def file_sha256(path: str) -> str:
+    """Hash a file in fixed-size chunks, so large game archives are never held in memory at once."""
+    with open(path, "rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+class HashCache:
+    """Sidecar cache of file digests, so files that did not change since they were last hashed are not read again"""
+    def __init__(self, path: str):
+        self.path: str = path
+        self.digests: dict[str, list] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+        if os.path.isfile(path):
+            try:
+                with open(path, "r") as file:
+                    self.digests = json.load(file)
+            except ValueError:
+                self.digests = {}
+
+    def is_cached(self, path: str) -> bool:
+        fingerprint: list | None = stat_fingerprint(path)
+        if fingerprint is None: return False
+
+        filepath, *stat = fingerprint
+        with self.lock:
+            cached: list | None = self.digests.get(filepath)
+
+        return cached is not None and cached[:-1] == stat
+
+    def record(self, path: str, digest: str):
+        """Remember the digest of a file that is already known, such as a verified file that was moved"""
+        fingerprint: list | None = stat_fingerprint(path)
+        if fingerprint is None: return
+
+        filepath, *stat = fingerprint
+        with self.lock:
+            self.digests[filepath] = [*stat, digest]
+            self.save()
+
+    def sha256(self, path: str) -> str:
+        fingerprint: list | None = stat_fingerprint(path)
+        if fingerprint is None:
+            raise FileNotFoundError(path)
+
+        filepath, *stat = fingerprint
+        with self.lock:
+            cached: list | None = self.digests.get(filepath)
+            if cached is not None and cached[:-1] == stat:
+                return cached[-1]
+
+        digest: str = file_sha256(path)
+
+        with self.lock:
+            self.digests[filepath] = [*stat, digest]
+            self.save()
+
+        return digest
+
+    def save(self):
+        directory: str = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with write_atomic(self.path, "w") as file:
+            json.dump(self.digests, file, indent=4)
+
+def load_data(path: str, object_hook=None):
+    """
+    Load a JSON data table through a pickled copy in data_cache_dir, keyed by the SHA-256 of the source, so each table
+    is only parsed once. The pickle is kept in memory after its first use, and every call returns a new copy of the
+    table, so callers are free to modify it.
+    """
+    key: tuple = (*(stat_fingerprint(path) or [path]), object_hook.__name__ if object_hook else "")
+    if key in loaded_data:
+        return pickle.loads(loaded_data[key])
+
+    with open(path, "rb") as f:
+        source: bytes = f.read()
+
+    name: str = f"{os.path.splitext(os.path.basename(path))[0]}-{key[-1] or 'json'}"
+    compiled_file: str = os.path.join(data_cache_dir, f"{name}-{hashlib.sha256(source).hexdigest()}.pickle")
+
+    try:
+        with open(compiled_file, "rb") as f:
+            compiled: bytes = f.read()
+    except OSError:
+        compiled: bytes = pickle.dumps(json.loads(source, object_hook=object_hook), pickle.HIGHEST_PROTOCOL)
+
+        # The cache is only an optimization, the table is still usable if it cannot be written
+        try:
+            os.makedirs(data_cache_dir, exist_ok=True)
+            for stale in glob.glob(os.path.join(glob.escape(data_cache_dir), f"{glob.escape(name)}-*.pickle")):
+                os.remove(stale)
+
+            with write_atomic(compiled_file) as f:
+                f.write(compiled)
+        except OSError:
+            pass
+
+    loaded_data[key] = compiled
+    return pickle.loads(compiled)
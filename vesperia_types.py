@@ -1,9 +1,13 @@
 from enum import IntEnum
 import ctypes
-import copy
 import json
 import mmap
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class InstructionType(IntEnum):
     LEARN_ARTE = 0x183
@@ -113,6 +117,8 @@ class ArtesHeader(ctypes.Structure):
     def __init__(self, entries: int, entry_end: int):
         super().__init__("T8BTMA  ".encode(), entries, entry_end)
 
+# Arte Entry Structures by amount of Character IDs, see ArtesEntry.entry_class
+artes_entry_classes: dict[int, type[ctypes.Structure]] = {}
 
 class ArtesEntry(ctypes.Structure):
     """Byte Structure Template for Arte Entries in file data64/btl.svo/BTL_PACK.DAT/0004 (T8BTMA)"""
@@ -240,29 +246,31 @@ class ArtesEntry(ctypes.Structure):
             character_id_entry_size = kwargs["character_id_entries"]
             kwargs["character_ids"] = (ctypes.c_uint32 * character_id_entry_size)(*kwargs["character_ids"])
 
-        local_fields = copy.deepcopy(cls._fields_)
-        local_fields[-1] = ("character_ids", ctypes.c_uint32 * character_id_entry_size)
+        return cls.entry_class(character_id_entry_size)(*args, **kwargs)
+
+    @classmethod
+    def entry_class(cls, character_id_entries: int) -> type[ctypes.Structure]:
+        """Get the Structure for an Arte Entry with the given amount of Character IDs, only creating it once per size"""
+        if character_id_entries not in artes_entry_classes:
+            local_fields = list(cls._fields_)
+            local_fields[-1] = ("character_ids", ctypes.c_uint32 * character_id_entries)
+
+            class BaseArteEntry(ctypes.Structure):
+                _pack_ = 1
+                _fields_ = local_fields
+
+            artes_entry_classes[character_id_entries] = BaseArteEntry
 
-        class BaseArteEntry(ctypes.Structure):
-            _pack_ = 1
-            _fields_ = local_fields
-        return BaseArteEntry(*args, **kwargs)
+        return artes_entry_classes[character_id_entries]
 
     @classmethod
     def from_buffer_copy(cls, source, offset:... = 0):
-        character_id_entry_size_position: int = ctypes.sizeof(cls) - 8
+        character_id_entry_size_position: int = offset + ctypes.sizeof(cls) - 8
         character_id_entry_size: int = int.from_bytes(
             source[character_id_entry_size_position:character_id_entry_size_position + 4], "little"
         )
 
-        local_fields = copy.deepcopy(cls._fields_)
-        local_fields[-1] = ("character_ids", ctypes.c_uint32 * character_id_entry_size)
-
-        class BaseArteEntry(ctypes.Structure):
-            _pack_ = 1
-            _fields_ = local_fields
-
-        return BaseArteEntry.from_buffer_copy(source, offset)
+        return cls.entry_class(character_id_entry_size).from_buffer_copy(source, offset)
 
 class ItemEntry(ctypes.BigEndianStructure):
     _pack_ = 1
@@ -730,4 +738,112 @@ def generate_skills_file(file: str, header: SkillsHeader, skills: list[SkillsEnt
             mm.write(("x\00" + string).encode('utf-8'))
 
         mm.flush()
-        f.close()
\ No newline at end of file
+        f.close()
+
+# Offset and size of the fields of Structures, see field_offsets
+structure_field_offsets: dict[type, dict[str, tuple[int, int]]] = {}
+
+def field_offsets(structure: type[ctypes.Structure]) -> dict[str, tuple[int, int]]:
+    """Offset and size of every field of a Structure, as laid out by ctypes from its _fields_"""
+    if structure not in structure_field_offsets:
+        structure_field_offsets[structure] = {name: (getattr(structure, name).offset, getattr(structure, name).size)
+                                              for name, _ in structure._fields_}
+
+    return structure_field_offsets[structure]
+
+def table_dtype(structure: type[ctypes.Structure]):
+    """
+    NumPy structured dtype with the same layout as a Structure. Offsets are taken from the fields ctypes laid out,
+    so _pack_ is honoured, and BigEndianStructures get big endian fields.
+    """
+    names: list[str] = []
+    formats: list = []
+    offsets: list[int] = []
+    for name, field_type in structure._fields_:
+        if issubclass(field_type, ctypes.Array) and field_type._type_ is ctypes.c_char:
+            formats.append(f"S{field_type._length_}")
+        else:
+            formats.append(numpy.dtype(field_type))
+
+        names.append(name)
+        offsets.append(field_offsets(structure)[name][0])
+
+    dtype = numpy.dtype({"names": names, "formats": formats, "offsets": offsets,
+                         "itemsize": ctypes.sizeof(structure)})
+    return dtype.newbyteorder(">") if issubclass(structure, ctypes.BigEndianStructure) else dtype
+
+def write_table(structure: type[ctypes.Structure], buffer, offset: int, entries: dict[int, dict]):
+    """
+    Write whole entries of a table of fixed size Structures in a writable buffer, by their index in the table.
+    With NumPy, the table is viewed in place and written column by column, otherwise entries are encoded one by one.
+    """
+    if not entries: return
+
+    if numpy is None:
+        entry_size: int = ctypes.sizeof(structure)
+        for index, values in entries.items():
+            position: int = offset + index * entry_size
+            buffer[position:position + entry_size] = bytes(structure(**{name: values[name]
+                                                                        for name, _ in structure._fields_}))
+        return
+
+    table = numpy.frombuffer(buffer, table_dtype(structure), max(entries) + 1, offset)
+    indices = numpy.fromiter(entries.keys(), numpy.intp, len(entries))
+    for name in table.dtype.names:
+        table[name][indices] = [values[name] for values in entries.values()]
+
+    # Drop the view right away, the buffer cannot be released while it is exported
+    del table
+
+def write_fields(structure: type[ctypes.Structure], buffer, offset: int, entries: dict[int, dict]):
+    """
+    Write only the given fields of entries in a table of fixed size Structures in a writable buffer, by their index in
+    the table. Every other byte of the entries is left as it is.
+    Every field is checked and encoded before anything is written, so invalid entries leave the buffer untouched.
+    """
+    fields: dict[str, tuple[int, int]] = field_offsets(structure)
+    entry_size: int = ctypes.sizeof(structure)
+
+    # Fields are encoded in a scratch entry first, so they get the byte order of the Structure
+    scratch: ctypes.Structure = structure.from_buffer_copy(bytes(entry_size))
+    address: int = ctypes.addressof(scratch)
+
+    encoded: list[tuple[int, bytes]] = []
+    for index, values in entries.items():
+        position: int = offset + index * entry_size
+        assert 0 <= index and position + entry_size <= len(buffer), f"Entry {index} is outside of the table."
+
+        for name, value in values.items():
+            assert name in fields, f"{structure.__name__} does not have a field named {name}."
+            field_offset, size = fields[name]
+
+            # Strings are stored decoded in the data files, see VesperiaStructureEncoder
+            ctypes.memset(address + field_offset, 0, size)
+            setattr(scratch, name, value.encode() if isinstance(value, str) else value)
+
+            encoded.append((position + field_offset, ctypes.string_at(address + field_offset, size)))
+
+    for position, data in encoded:
+        buffer[position:position + len(data)] = data
+
+def encode_table(structure: type[ctypes.Structure], count: int, columns: dict[str, list],
+                 template: ctypes.Structure = None) -> bytes:
+    """
+    Encode a table of fixed size Structures in one block. Fields in columns are filled with one value per entry, and
+    every other field is copied from template.
+    """
+    template_data: bytes = bytes(template if template is not None else structure())
+
+    if numpy is None:
+        table: list[ctypes.Structure] = [structure.from_buffer_copy(template_data) for _ in range(count)]
+        for name, values in columns.items():
+            for entry, value in zip(table, values):
+                setattr(entry, name, value)
+
+        return b"".join(bytes(entry) for entry in table)
+
+    table = numpy.frombuffer(template_data * count, table_dtype(structure)).copy()
+    for name, values in columns.items():
+        table[name] = values
+
+    return table.tobytes()
@@ -0,0 +1,120 @@
+import importlib.util
+import threading
+import queue
+import os
+
+from concurrent.futures import Future
+
+from runner import ToolResult
+
+
+class HyoutaWorker:
+    """
+    Long-lived host for HyoutaToolsCLI.
+
+    The .NET runtime is loaded once into the current process through pythonnet, and queued commands are run
+    one at a time on a dedicated thread by invoking the entry point of HyoutaToolsCLI.dll directly.
+    """
+    def __init__(self, path: str):
+        self.path: str = path
+        self.entry_point = None
+
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._started: threading.Event = threading.Event()
+        self._error: str = ""
+
+    @classmethod
+    def is_supported(cls, path: str) -> bool:
+        if not path.endswith(".dll"):
+            return False
+
+        # Only check that pythonnet is installed, the runtime is loaded by the worker thread
+        return importlib.util.find_spec("pythonnet") is not None
+
+    def start(self) -> bool:
+        """Start the worker thread and load the runtime. Returns False if the runtime could not be loaded."""
+        self._thread = threading.Thread(target=self._serve, name="HyoutaWorker", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+        if self._error:
+            print(f"> Could not start a persistent HyoutaToolsCLI host: {self._error}")
+            return False
+
+        return True
+
+    def stop(self):
+        if self._thread is None: return
+
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, command: list[str], args: list[str]) -> Future:
+        """Queue a command for the host. The Future resolves to the ToolResult of the command."""
+        future: Future = Future()
+        self._queue.put((future, command, args))
+
+        return future
+
+    def run(self, command: list[str], args: list[str]) -> ToolResult:
+        return self.submit(command, args).result()
+
+    def _load(self):
+        from pythonnet import load
+
+        runtime_config: str = os.path.splitext(self.path)[0] + ".runtimeconfig.json"
+        if os.path.isfile(runtime_config):
+            load("coreclr", runtime_config=runtime_config)
+        else:
+            load("coreclr")
+
+        import clr
+        from System.Reflection import Assembly
+
+        self.entry_point = Assembly.LoadFrom(os.path.abspath(self.path)).EntryPoint
+        assert self.entry_point is not None, f"{self.path} does not have an entry point."
+
+    def _invoke(self, command: list[str], args: list[str]) -> ToolResult:
+        from System import Array, Console, Object, String
+        from System.IO import StringWriter, TextWriter
+        from System.Reflection import TargetInvocationException
+
+        stdout, stderr = Console.Out, Console.Error
+        error_writer = StringWriter()
+
+        Console.SetOut(TextWriter.Null)
+        Console.SetError(error_writer)
+        try:
+            parameters = Array[Object]([Array[String](args)]) if self.entry_point.GetParameters().Length else None
+            returncode = self.entry_point.Invoke(None, parameters)
+            returncode = int(returncode) if returncode is not None else 0
+        except TargetInvocationException as e:
+            return ToolResult(command, 1, str(e.InnerException))
+        finally:
+            Console.SetOut(stdout)
+            Console.SetError(stderr)
+
+        return ToolResult(command, returncode, error_writer.ToString())
+
+    def _serve(self):
+        try:
+            self._load()
+        except Exception as e:
+            self._error = str(e)
+            return
+        finally:
+            self._started.set()
+
+        while True:
+            job = self._queue.get()
+            if job is None: break
+
+            future, command, args = job
+            if not future.set_running_or_notify_cancel(): continue
+
+            try:
+                future.set_result(self._invoke(command, args))
+            except Exception as e:
+                future.set_exception(e)